@@ -0,0 +1,288 @@
+"""聊天收发性能基准
+
+在临时目录中生成合成的聊天仓库（可配置作者数、历史消息数和消息长度），以本地裸仓库充当远程，
+并跳过对 GitHub/Gitee 的 HTTP 连接检查，因此可以离线运行。测量以下各项的延迟分位数和内存峰值：
+
+- startup_cold：首次打开聊天（克隆并解密全部历史）
+- startup_warm：再次打开已有的本地仓库并读取消息
+- send：逐条发送消息（提交并推送）
+- receive：其他参与者发送新消息后的接收
+- receive_noop：没有新消息时的接收
+- decrypt / verify：单条消息的解密和哈希验证
+
+结果保存为 JSON，可用 --compare 与之前版本的结果对比。
+
+用法：python -m benchmarks.chat_benchmark [--authors 3] [--messages 2000] [--size 200] [--output 结果.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from src.crypto.crypto_utils import MessageCrypto
+from src.git import message_log
+from src.git.git_messenger import GitMessenger
+from versioning.version import VERSION_STR
+
+# 合成消息的字符集（中英文混合）
+_ALPHABET = '我们你他这是的了在有和不就人都一个上也很到说要去会着没看好自己abcdefghijklmnopqrstuvwxyz     '
+
+
+class OfflineMessenger(GitMessenger):
+    """跳过 HTTP 连接检查的 GitMessenger（远程为本地裸仓库）"""
+
+    def _check_git_connection(self):
+        return True
+
+
+def percentiles(samples):
+    """延迟样本（秒）的统计，单位为毫秒"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * 1000,
+        'p50_ms': pick(0.50),
+        'p90_ms': pick(0.90),
+        'p99_ms': pick(0.99),
+        'max_ms': ordered[-1] * 1000
+    }
+
+
+class Phase:
+    """测量一个阶段：收集每次操作的耗时和内存峰值
+
+    tracemalloc 会明显拖慢被测代码，因此耗时只在未跟踪时测量；
+    内存峰值由额外执行的一次跟踪操作得到（只包含 Python 堆，不含 git 和解密子进程）。
+    """
+
+    def __init__(self, name, results):
+        self.name = name
+        self.results = results
+        self.samples = []
+        self.peak = 0
+
+    def __enter__(self):
+        return self
+
+    def time(self, operation, *args, **kwargs):
+        started = time.perf_counter()
+        result = operation(*args, **kwargs)
+        self.samples.append(time.perf_counter() - started)
+        return result
+
+    def traced(self, operation, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            return operation(*args, **kwargs)
+        finally:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    def __exit__(self, *exc):
+        self.results[self.name] = dict(percentiles(self.samples), peak_memory_mb=self.peak / 1024 / 1024)
+        print(f"  {self.name:<14} p50 {self.results[self.name].get('p50_ms', 0):9.2f} ms  "
+              f"p99 {self.results[self.name].get('p99_ms', 0):9.2f} ms  "
+              f"峰值内存 {self.results[self.name]['peak_memory_mb']:7.1f} MB")
+
+
+def random_text(rng, size):
+    return ''.join(rng.choice(_ALPHABET) for _ in range(size)).strip() or '消息'
+
+
+def generate_history(workdir, crypto, authors, count, size, months, rng):
+    """直接写入合成的消息日志并推送到本地裸仓库，返回裸仓库路径"""
+    remote = os.path.join(workdir, 'remote.git')
+    seed = os.path.join(workdir, 'seed')
+    subprocess.run(['git', 'init', '-q', '--bare', '-b', 'main', remote], check=True)
+    subprocess.run(['git', 'init', '-q', '-b', 'main', seed], check=True)
+
+    # 消息均匀分布在最近 months 个月内，每个作者按时间顺序延续自己的哈希链
+    now = datetime.now()
+    start = now - timedelta(days=30 * months)
+    step = (now - start) / max(count, 1)
+    prev_hashes = {}
+    files = {}
+    for i in range(count):
+        author = f'user{i % authors}'
+        timestamp = start + step * i
+        message = {'content': random_text(rng, size), 'author': author, 'timestamp': timestamp.isoformat()}
+        encrypted = crypto.encrypt_message(message, prev_hashes.get(author))
+        prev_hashes[author] = message['hash']
+        name = message_log.message_file_name(author, message_log.segment_period(timestamp))
+        files.setdefault(name, []).append(encrypted)
+
+    for name, messages in files.items():
+        message_log.create_log(os.path.join(seed, name), messages)
+    git_env = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@example.com',
+                   GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@example.com')
+    subprocess.run(['git', '-C', seed, 'add', '-A'], check=True)
+    subprocess.run(['git', '-C', seed, 'commit', '-q', '-m', 'Synthetic history'], check=True, env=git_env)
+    subprocess.run(['git', '-C', seed, 'push', '-q', remote, 'main'], check=True)
+    return remote
+
+
+def open_messenger(path, remote, username, mnemonic, key, args):
+    return OfflineMessenger(path, remote, username, None, mnemonic, chat_key=key, batch_window=0,
+                            remote_probe_ttl=0, recent_segments=args.recent_segments)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='sealtext-bench-')
+    results = {}
+    try:
+        mnemonic = MessageCrypto.generate_mnemonic()
+        crypto = MessageCrypto(mnemonic)
+        key = crypto.key
+
+        print(f"生成合成仓库：{args.authors} 个作者，{args.messages} 条消息，每条约 {args.size} 字符")
+        started = time.perf_counter()
+        remote = generate_history(workdir, crypto, args.authors, args.messages, args.size, args.months, rng)
+        print(f"  用时 {time.perf_counter() - started:.1f} 秒")
+
+        # 解密和验证：在同一批密文上分别测量
+        ciphertexts = []
+        for i in range(args.crypto_samples):
+            message = {'content': random_text(rng, args.size), 'author': 'user0',
+                       'timestamp': datetime.now().isoformat()}
+            ciphertexts.append(crypto.encrypt_message(message))
+        with Phase('decrypt', results) as phase:
+            decrypted = [phase.time(crypto.decrypt_message, token, False) for token in ciphertexts]
+            phase.traced(lambda: [crypto.decrypt_message(token, False) for token in ciphertexts])
+        with Phase('verify', results) as phase:
+            for message in decrypted:
+                phase.time(crypto.calculate_message_hash, message, message.get('prev_hash'))
+            phase.traced(lambda: [crypto.calculate_message_hash(m, m.get('prev_hash')) for m in decrypted])
+
+        def cold_start(i):
+            return _open_and_read(os.path.join(workdir, f'cold{i}'), remote, 'reader', mnemonic, key, args)
+
+        with Phase('startup_cold', results) as phase:
+            for i in range(args.startup_rounds):
+                phase.time(cold_start, i).close()
+            phase.traced(cold_start, args.startup_rounds).close()
+
+        reader = os.path.join(workdir, 'reader')
+
+        def warm_start():
+            return _open_and_read(reader, remote, 'reader', mnemonic, key, args)
+
+        warm_start().close()
+        with Phase('startup_warm', results) as phase:
+            for _ in range(args.startup_rounds):
+                phase.time(warm_start).close()
+            phase.traced(warm_start).close()
+
+        sender = open_messenger(os.path.join(workdir, 'sender'), remote, 'sender', mnemonic, key, args)
+        receiver = open_messenger(reader, remote, 'reader', mnemonic, key, args)
+        receiver.receive_messages()
+        try:
+            with Phase('send', results) as phase:
+                for _ in range(args.sends):
+                    phase.time(sender.send_message, random_text(rng, args.size), 'sender')
+                phase.traced(sender.send_message, random_text(rng, args.size), 'sender')
+
+            receiver.receive_messages()
+            with Phase('receive', results) as phase:
+                for _ in range(args.receives + 1):
+                    sender.send_message(random_text(rng, args.size), 'sender')
+                    if len(phase.samples) < args.receives:
+                        phase.time(receiver.receive_messages)
+                    else:
+                        phase.traced(receiver.receive_messages)
+
+            with Phase('receive_noop', results) as phase:
+                for _ in range(args.receives):
+                    phase.time(receiver.receive_messages)
+                phase.traced(receiver.receive_messages)
+        finally:
+            sender.close()
+            receiver.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _open_and_read(path, remote, username, mnemonic, key, args):
+    messenger = open_messenger(path, remote, username, mnemonic, key, args)
+    messenger.receive_messages()
+    return messenger
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', '--version'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    """与之前保存的结果对比 p50 和 p99"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\n与 {baseline_path}（v{baseline.get('version')}）对比：")
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('count') or not current.get('count'):
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            change = (current[key] - previous[key]) / previous[key] * 100 if previous[key] else 0.0
+            print(f"  {name:<14} {key:<7} {previous[key]:9.2f} -> {current[key]:9.2f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天收发性能基准（离线，使用本地裸仓库作为远程）')
+    parser.add_argument('--authors', type=int, default=3, help='合成历史中的作者数')
+    parser.add_argument('--messages', type=int, default=2000, help='合成历史中的消息数')
+    parser.add_argument('--size', type=int, default=200, help='每条消息的字符数')
+    parser.add_argument('--months', type=int, default=3, help='历史消息分布的月数（即分段数）')
+    parser.add_argument('--recent-segments', type=int, default=None, help='只加载最新的若干个分段')
+    parser.add_argument('--sends', type=int, default=30, help='发送测量的消息数')
+    parser.add_argument('--receives', type=int, default=20, help='接收测量的次数')
+    parser.add_argument('--startup-rounds', type=int, default=3, help='冷启动和热启动各测量的次数')
+    parser.add_argument('--crypto-samples', type=int, default=2000, help='解密和验证测量的消息数')
+    parser.add_argument('--seed', type=int, default=0, help='合成内容的随机种子')
+    parser.add_argument('--output', help='结果 JSON 文件路径（默认 bench-<版本>-<时间>.json）')
+    parser.add_argument('--compare', help='与之前保存的结果 JSON 对比')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(name)s: %(message)s', force=True)
+    results = run(args)
+
+    report = {
+        'version': VERSION_STR,
+        'created_at': datetime.now().isoformat(),
+        'params': vars(args),
+        'environment': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'git': git_version(),
+            'cpus': os.cpu_count()
+        },
+        'results': results
+    }
+    output = args.output or f"bench-{VERSION_STR}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
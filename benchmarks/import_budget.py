@@ -0,0 +1,73 @@
+"""入口模块的导入耗时检查
+
+命令行和 Web 服务端在显示第一个提示之前只应加载必需的模块，GitPython、requests、rich、
+mnemonic 和 multiprocessing 等较重的依赖在第一次用到时才导入。该脚本在新的子进程中用
+python -X importtime 导入各入口模块，检查：
+
+- 导入耗时（多次测量取最小值）不超过预算
+- 启动时不应加载的模块没有被导入
+
+超出预算或加载了不应加载的模块时以非零状态退出，可以在构建前运行以防止启动变慢。
+
+用法：python -m benchmarks.import_budget [--runs 5] [--scale 1.0]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# 入口模块 -> (预算毫秒, 启动时不应加载的模块)
+ENTRY_POINTS = {
+    'src.git.git_chat': (120, ('git', 'gitdb', 'requests', 'urllib3', 'rich', 'mnemonic', 'multiprocessing',
+                               'fastapi')),
+    'src.api.api': (800, ('git', 'gitdb', 'requests', 'rich', 'mnemonic', 'multiprocessing')),
+    'main': (30, ('src.git.git_chat', 'git', 'gitdb', 'requests', 'rich', 'mnemonic', 'multiprocessing',
+                  'fastapi')),
+    'run_api': (30, ('src.api.api', 'uvicorn', 'fastapi', 'git', 'gitdb', 'multiprocessing')),
+}
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_PROBE = "import sys, {module}; print('\\n'.join(sys.modules))"
+
+
+def measure(module):
+    """在新的子进程中导入模块，返回 (累计耗时毫秒, 各模块自身耗时毫秒, 已加载的模块名)"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module)],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    total, own = None, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        own[name.strip()] = int(self_us) / 1000
+        if name.strip() == module:
+            total = int(cumulative_us) / 1000
+    return total, own, set(result.stdout.split())
+
+
+def check(module, budget_ms, forbidden, runs):
+    timings = [measure(module) for _ in range(runs)]
+    total, own, loaded = min(timings, key=lambda timing: timing[0])
+    leaked = sorted(name for name in forbidden if name in loaded)
+    ok = total <= budget_ms and not leaked
+    print(f"{'通过' if ok else '失败'}  {module:<20} {total:8.1f} ms（预算 {budget_ms:.0f} ms）")
+    if leaked:
+        print(f"      启动时加载了不应加载的模块: {', '.join(leaked)}")
+    if not ok:
+        for name, ms in sorted(own.items(), key=lambda item: item[1], reverse=True)[:10]:
+            print(f"      {ms:8.1f} ms  {name}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查入口模块的导入耗时和启动时加载的依赖')
+    parser.add_argument('--runs', type=int, default=5, help='每个入口测量的次数（取最小值）')
+    parser.add_argument('--scale', type=float, default=1.0, help='预算的倍数（用于较慢的机器）')
+    args = parser.parse_args()
+
+    results = [check(module, budget * args.scale, forbidden, args.runs)
+               for module, (budget, forbidden) in ENTRY_POINTS.items()]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import sys
+import logging
 import os
-from src.git.git_chat import run_chat
 from versioning.version import VERSION_STR, APP_NAME, DESCRIPTION, COPYRIGHT
 
 def print_banner():
@@ -19,10 +19,18 @@ def print_banner():
 ====================={DESCRIPTION}=====================
     """)
 
+def configure_logging():
+    """日志只在入口配置，默认只显示警告和错误，可通过环境变量 SEALTEXT_LOG_LEVEL 调整（如 DEBUG）"""
+    logging.basicConfig(level=os.environ.get('SEALTEXT_LOG_LEVEL', 'WARNING').upper(),
+                        format='%(levelname)s %(name)s: %(message)s')
+
 def main():
     """程序主入口"""
     try:
+        configure_logging()
         print_banner()
+        # 先显示横幅再加载聊天模块，GitPython 等较重的依赖在选择聊天后才导入
+        from src.git.git_chat import run_chat
         run_chat()
     except KeyboardInterrupt:
         print("\n👋 程序已退出")
@@ -31,4 +39,7 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # 打包后的可执行文件中启动解密子进程需要；只在作为入口运行时导入
+    import multiprocessing
+    multiprocessing.freeze_support()
     main() 
\ No newline at end of file
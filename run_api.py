@@ -1,17 +1,29 @@
-import uvicorn
 import argparse
-from src.api.api import app
+import logging
+import os
 from versioning.version import VERSION_STR, APP_NAME
 
+def configure_logging():
+    """日志只在入口配置，默认级别为 INFO，可通过环境变量 SEALTEXT_LOG_LEVEL 调整"""
+    logging.basicConfig(level=os.environ.get('SEALTEXT_LOG_LEVEL', 'INFO').upper(),
+                        format='%(levelname)s %(name)s: %(message)s')
+
 def main():
     parser = argparse.ArgumentParser(description=f'{APP_NAME} Web Server')
     parser.add_argument('--host', default='127.0.0.1', help='监听地址')
     parser.add_argument('--port', type=int, default=8000, help='监听端口')
     args = parser.parse_args()
+    configure_logging()
 
     print(f"启动 {APP_NAME} Web 服务器 v{VERSION_STR}")
+    # 解析参数之后再加载 Web 框架和应用（--help 不必等待）
+    import uvicorn
+    from src.api.api import app
     print(f"访问地址: http://{args.host}:{args.port}")
     uvicorn.run(app, host=args.host, port=args.port)
 
 if __name__ == "__main__":
+    # 打包后的可执行文件中启动解密子进程需要；只在作为入口运行时导入
+    import multiprocessing
+    multiprocessing.freeze_support()
     main() 
\ No newline at end of file
@@ -1,16 +1,31 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Iterator, List, Optional
 from datetime import datetime
 from src.git.git_chat import GitChat
-from src.config import load_config, save_config
+from src.store.message_store import InvalidCursorError
+from src.config import get_config_snapshot, save_config, local_repo_name
+from src import metrics
+from src.api.message_stream import format_event
+from src.api.executor import BlockingExecutor
+from src.api.sessions import (
+    ChatRegistry,
+    ChatSession,
+    make_chat_id,
+    DEFAULT_MAX_CHATS,
+    DEFAULT_MAX_MEMORY_BYTES
+)
+import asyncio
+import logging
 import os
 import sys
 from versioning.version import VERSION_STR, APP_NAME
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="SealText API")
 
 # 允许跨域请求
@@ -38,6 +53,23 @@ class Message(BaseModel):
     content: str
     author: str
     timestamp: str
+    hash: Optional[str] = None
+
+class MessagePage(BaseModel):
+    messages: List[Message]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    has_more_before: bool = False
+    has_more_after: bool = False
+
+class SearchResult(BaseModel):
+    messages: List[Message]
+    total: int = 0
+    offset: int = 0
+    limit: int = 20
+    has_more: bool = False
+    # total 是否为估算值（没有逐条确认全部候选）
+    total_estimated: bool = False
 
 class ChatConfig(BaseModel):
     platform: str
@@ -46,19 +78,75 @@ class ChatConfig(BaseModel):
     token: str
     chat_mnemonic: str
 
-# 全局聊天实例
-chat_instance: Optional[GitChat] = None
+# 已打开的聊天，按平台和仓库地址索引，超出上限时按 LRU 淘汰
+registry = ChatRegistry()
+
+# 消息推送：由每个聊天的后台同步器拉取新消息，再推送给该聊天的订阅者
+# 没有新消息时推送的心跳间隔（秒）
+STREAM_HEARTBEAT = 15
 
-def get_chat():
-    if not chat_instance:
-        raise HTTPException(status_code=400, detail="Chat not initialized")
-    return chat_instance
+# 阻塞操作（git 拉取推送、解密、配置读写）都在有界线程池中执行，不阻塞事件循环
+EXECUTOR_WORKERS = 4
+# 普通操作的超时时间（秒）
+OPERATION_TIMEOUT = 60
+# 初始化聊天可能需要克隆仓库，超时时间更长
+INIT_TIMEOUT = 300
+# 发送成功后等待刷新的时间，超时直接返回，新消息由后台同步补上
+SEND_REFRESH_TIMEOUT = 10
+executor = BlockingExecutor(EXECUTOR_WORKERS, OPERATION_TIMEOUT)
+
+# Web 服务端默认记录耗时指标，通过 /metrics 导出
+metrics.enable()
+
+def _timeout_error(operation: str, hint: str = "请稍后重试"):
+    return HTTPException(status_code=504, detail=f"{operation}超时，{hint}")
+
+def _attach_broadcaster(session: ChatSession):
+    """把同步器发现的新消息转发到事件循环中的推送器"""
+    loop = asyncio.get_running_loop()
+    session.chat.syncer.add_listener(
+        lambda new_messages, snapshot: loop.call_soon_threadsafe(session.broadcaster.publish, new_messages)
+    )
+
+async def _close_session(session: ChatSession):
+    """关闭会话：断开订阅者，停止同步并等待发送队列清空"""
+    session.broadcaster.close()
+    try:
+        await executor.run(session.chat.close, key=session.chat)
+    except Exception as e:
+        logger.error(f"关闭聊天 {session.chat_id} 失败: {str(e)}")
+    executor.discard_key(session.chat)
+    executor.discard_key(session.local_name)
+
+def _check_local_conflict(local_name: str, chat_id: str):
+    """本地仓库目录和消息库按“平台_仓库名”命名，另一个同名仓库已打开时不能再打开"""
+    other = registry.find_local(local_name, exclude=chat_id)
+    if other:
+        raise HTTPException(status_code=409, detail=f"同名仓库 {other.repo_url} 已打开，请先关闭它")
+
+def get_session(chat_id: Optional[str] = None) -> Iterator[ChatSession]:
+    """按 chat_id 获取已打开的聊天，未指定时使用最近使用的聊天
+
+    请求处理期间会话标记为使用中，不会被 LRU 淘汰。
+    """
+    session = registry.acquire(chat_id)
+    if not session:
+        if chat_id is None:
+            raise HTTPException(status_code=400, detail="Chat not initialized")
+        raise HTTPException(status_code=404, detail="聊天未打开或已被关闭")
+    try:
+        yield session
+    finally:
+        registry.release(session)
+
+def get_chat(session: ChatSession = Depends(get_session)) -> GitChat:
+    return session.chat
 
 @app.get("/config")
 async def get_config():
     """获取已保存的配置"""
     try:
-        config = load_config()
+        config = await executor.run(get_config_snapshot)
         if not config:
             raise HTTPException(status_code=404, detail="未找到配置")
         return {
@@ -66,15 +154,25 @@ async def get_config():
             "display_name": config.get('display_name'),
             "repos": config.get('repos', {})
         }
+    except asyncio.TimeoutError:
+        raise _timeout_error("读取配置")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/init")
 async def initialize_chat(repo_url: str, platform: str):
-    """使用已保存的配置初始化聊天"""
-    global chat_instance
+    """使用已保存的配置初始化聊天，返回后续请求使用的 chat_id
+
+    已打开的聊天直接复用，不会重复连接、拉取和派生密钥。
+    """
     try:
-        config = load_config()
+        chat_id = make_chat_id(platform, repo_url)
+        if registry.get(chat_id):
+            return {"status": "success", "message": "Chat initialized", "chat_id": chat_id}
+        local_name = local_repo_name(platform, repo_url)
+        _check_local_conflict(local_name, chat_id)
+        
+        config = await executor.run(get_config_snapshot)
         if not config or platform not in config['platforms']:
             raise HTTPException(status_code=400, detail="无效的平台配置")
         
@@ -84,36 +182,192 @@ async def initialize_chat(repo_url: str, platform: str):
         if not repo_info:
             raise HTTPException(status_code=400, detail="未找到仓库配置")
         
-        chat_instance = GitChat(
-            repo_url,
-            platform,
-            platform_info['username'],
-            platform_info['token'],
-            repo_info['mnemonic']
-        )
-        return {"status": "success", "message": "Chat initialized"}
+        def open_chat():
+            # 排在前面的初始化完成后聊天已登记，不再重复打开同一个仓库
+            if registry.get(chat_id):
+                return None
+            _check_local_conflict(local_name, chat_id)
+            return GitChat(
+                repo_url,
+                platform,
+                platform_info['username'],
+                platform_info['token'],
+                repo_info['mnemonic']
+            )
+        
+        try:
+            # 使用同一个本地目录的聊天按目录串行初始化，避免并发克隆到同一个目录
+            chat = await executor.run(open_chat, key=local_name, timeout=INIT_TIMEOUT)
+        except SystemExit:
+            # GitChat 在仓库连接失败时会调用 sys.exit，这里不能让它终止服务
+            raise HTTPException(status_code=400, detail="仓库连接失败")
+        if chat is None:
+            return {"status": "success", "message": "Chat initialized", "chat_id": chat_id}
+        
+        # 前一个初始化在本次打开之后才完成登记时，只保留先登记的那个
+        if registry.get(chat_id) or registry.find_local(local_name, exclude=chat_id):
+            await executor.run(chat.close, key=chat)
+            _check_local_conflict(local_name, chat_id)
+            return {"status": "success", "message": "Chat initialized", "chat_id": chat_id}
+        
+        session = ChatSession(chat_id, platform, repo_url, chat)
+        _attach_broadcaster(session)
+        chat.start_sync()
+        registry.max_chats = config.get('max_open_chats', DEFAULT_MAX_CHATS)
+        registry.max_memory_bytes = int(config.get('max_chats_memory_mb', 0) * 1024 * 1024) or DEFAULT_MAX_MEMORY_BYTES
+        for evicted in registry.add(session):
+            logger.debug(f"淘汰空闲聊天: {evicted.chat_id}")
+            await _close_session(evicted)
+        return {"status": "success", "message": "Chat initialized", "chat_id": chat_id}
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise _timeout_error("初始化聊天")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/messages", response_model=List[Message])
-async def get_messages(chat: GitChat = Depends(get_chat)):
-    """获取所有消息"""
+@app.get("/messages", response_model=MessagePage)
+async def get_messages(
+    since: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    author: Optional[str] = None,
+    session: ChatSession = Depends(get_session)
+):
+    """按游标分页获取消息
+
+    since: 只返回该游标之后的新消息；before: 返回该游标之前的历史消息；
+    都不指定时返回最新的 limit 条（不指定 limit 则返回全部）；author 只返回该作者的消息。
+    """
+    try:
+        # 读取本地消息库或快照不需要与写操作串行
+        page = await executor.run(session.chat.get_messages_page, since, before, limit, author=author)
+        # 加载历史会让解密缓存增长，超出内存上限时淘汰其他空闲聊天
+        for evicted in registry.enforce_limits(keep=session.chat_id):
+            await _close_session(evicted)
+        return page
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except asyncio.TimeoutError:
+        raise _timeout_error("获取消息")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/messages/search", response_model=SearchResult)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    author: Optional[str] = None,
+    session: ChatSession = Depends(get_session)
+):
+    """全文搜索消息，按相关度排序并分页"""
     try:
-        messages = chat.get_messages()
-        return messages
+        return await executor.run(session.chat.search_messages, q, limit, offset, author)
+    except asyncio.TimeoutError:
+        raise _timeout_error("搜索消息")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/messages/stream")
+async def stream_messages(request: Request, since: Optional[str] = None, session: ChatSession = Depends(get_session)):
+    """以 Server-Sent Events 推送新消息
+
+    断线重连时浏览器会带上 Last-Event-ID，也可以用 since 指定游标，
+    服务端会先补发游标之后的消息。
+    """
+    resume_cursor = request.headers.get('last-event-id') or since
+    chat = session.chat
+    broadcaster = session.broadcaster
+    queue = broadcaster.subscribe()
+    # 先订阅再读取游标之后的消息，避免漏掉期间到达的消息；游标无效时在开始推送前返回 400
+    backlog = []
+    if resume_cursor:
+        try:
+            backlog = (await executor.run(chat.get_messages_page, resume_cursor))['messages']
+        except InvalidCursorError as e:
+            broadcaster.unsubscribe(queue)
+            raise HTTPException(status_code=400, detail=str(e))
+        except BaseException:
+            broadcaster.unsubscribe(queue)
+            raise
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            # 先补发游标之后的消息，记录已发送的游标避免与推送队列重复
+            sent = set()
+            for message in backlog:
+                if message.get('hash'):
+                    sent.add(message['hash'])
+                yield format_event(message)
+            
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message is None:
+                    break
+                if message.get('hash') in sent:
+                    continue
+                yield format_event(message)
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.post("/messages")
 async def send_message(message: str, chat: GitChat = Depends(get_chat)):
     """发送消息"""
     try:
-        config = load_config()
-        if chat.send_message(message, config['display_name']):
-            return {"status": "success", "message": "Message sent"}
-        raise HTTPException(status_code=500, detail="Failed to send message")
+        config = await executor.run(get_config_snapshot)
+        # 不按聊天串行也不占用工作线程：并发的发送进入同一个发送队列，合并为一次提交和推送
+        sent = chat.enqueue_message(message, config['display_name'])
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(sent)), executor.default_timeout)
+    except asyncio.TimeoutError:
+        raise _timeout_error("发送消息", "消息可能仍在后台发送中")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    try:
+        # 等待包含本条消息的同步完成，之后的读取能立即看到它，订阅者也会收到推送
+        await executor.run(chat.syncer.sync, fresh=True, timeout=SEND_REFRESH_TIMEOUT)
+    except Exception as e:
+        # 消息已经提交并推送，刷新失败不应让客户端认为发送失败而重发；后台同步会再次拉取
+        logger.warning(f"发送后刷新消息失败: {str(e) or type(e).__name__}")
+    return {"status": "success", "message": "Message sent"}
+
+@app.get("/chats")
+async def list_chats():
+    """列出已打开的聊天"""
+    return [session.info() for session in registry.sessions()]
+
+@app.delete("/chats/{chat_id}")
+async def close_chat(chat_id: str):
+    """关闭指定的聊天"""
+    session = registry.remove(chat_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="聊天未打开或已被关闭")
+    await _close_session(session)
+    return {"status": "success", "message": "Chat closed"}
+
+@app.get("/status")
+async def get_status():
+    """获取后台任务队列和已打开聊天的状态"""
+    return {
+        "executor": executor.stats(),
+        "chats": registry.stats()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """以 Prometheus 文本格式导出耗时直方图和计数器"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/")
 async def get_chat_page():
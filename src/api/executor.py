@@ -0,0 +1,87 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BlockingExecutor:
+    """在有界线程池中执行阻塞操作（git、加解密、配置文件读写）
+
+    指定 key 的操作按 key 串行执行（例如同一个聊天仓库的写操作），
+    每个操作都有超时时间，超时后调用方立即返回，后台操作继续执行完毕。
+    """
+
+    def __init__(self, max_workers=4, default_timeout=60):
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api-worker")
+        self._locks = {}
+        self._counter_lock = threading.Lock()
+        self._waiting = 0
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._timeouts = 0
+
+    def _wrap(self, fn, args, kwargs):
+        """包装任务以统计排队和运行中的数量"""
+        def task():
+            with self._counter_lock:
+                self._pending -= 1
+                self._running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counter_lock:
+                    self._running -= 1
+                    self._completed += 1
+        return task
+
+    async def run(self, fn, *args, key=None, timeout=None, **kwargs):
+        """在线程池中执行 fn，超时抛出 asyncio.TimeoutError"""
+        loop = asyncio.get_running_loop()
+        timeout = self.default_timeout if timeout is None else timeout
+        deadline = loop.time() + timeout
+        lock = self._locks.setdefault(key, asyncio.Lock()) if key is not None else None
+
+        if lock:
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                raise
+            finally:
+                self._waiting -= 1
+
+        with self._counter_lock:
+            self._pending += 1
+        future = loop.run_in_executor(self._pool, self._wrap(fn, args, kwargs))
+        if lock:
+            # 锁在后台操作真正结束后才释放，超时不会破坏串行化
+            future.add_done_callback(lambda _: lock.release())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise
+
+    def discard_key(self, key):
+        """不再使用的 key（例如已关闭的聊天）释放其串行锁"""
+        lock = self._locks.get(key)
+        if lock and not lock.locked():
+            del self._locks[key]
+
+    def stats(self):
+        """返回队列深度等统计信息"""
+        with self._counter_lock:
+            return {
+                'max_workers': self.max_workers,
+                'waiting': self._waiting,
+                'queued': self._pending,
+                'running': self._running,
+                'completed': self._completed,
+                'timeouts': self._timeouts
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每个订阅者最多积压的消息数，超出后断开该订阅者，由客户端带游标重连
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+def format_event(message, event='message'):
+    """将消息编码为 Server-Sent Events 格式，事件 id 为消息游标"""
+    lines = []
+    cursor = message.get('hash') or message.get('timestamp')
+    if cursor:
+        lines.append(f"id: {cursor}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(message, ensure_ascii=False)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class MessageBroadcaster:
+    """将服务端同步到的新消息推送给所有订阅者"""
+
+    def __init__(self):
+        self._subscribers = set()
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """新增订阅者，返回其消息队列"""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def close(self):
+        """断开所有订阅者"""
+        for queue in list(self._subscribers):
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self._subscribers.clear()
+
+    def publish(self, messages):
+        """向所有订阅者推送新消息"""
+        for queue in list(self._subscribers):
+            try:
+                for message in messages:
+                    queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # 积压过多的订阅者直接断开，客户端会带着游标重连补齐消息
+                logger.warning("订阅者消息积压过多，断开连接")
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                # None 表示连接需要关闭
+                queue.put_nowait(None)
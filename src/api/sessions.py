@@ -0,0 +1,148 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from src.api.message_stream import MessageBroadcaster
+from src.config import local_repo_name
+
+# 默认最多同时打开的聊天数量
+DEFAULT_MAX_CHATS = 8
+# 默认所有聊天解密缓存的内存总上限
+DEFAULT_MAX_MEMORY_BYTES = 256 * 1024 * 1024
+
+
+def make_chat_id(platform, repo_url):
+    """根据平台和仓库地址生成稳定的聊天 ID"""
+    return hashlib.sha256(f"{platform}:{repo_url}".encode('utf-8')).hexdigest()[:16]
+
+
+class ChatSession:
+    """一个已打开的聊天及其推送器"""
+
+    def __init__(self, chat_id, platform, repo_url, chat):
+        self.chat_id = chat_id
+        self.platform = platform
+        self.repo_url = repo_url
+        # 本地仓库目录和消息库的名称，同名的聊天不能同时打开
+        self.local_name = local_repo_name(platform, repo_url)
+        self.chat = chat
+        self.broadcaster = MessageBroadcaster()
+        self.opened_at = time.time()
+        self.last_used = self.opened_at
+        # 正在处理的请求数，由 ChatRegistry.acquire/release 维护
+        self.active = 0
+
+    def is_idle(self):
+        """没有进行中的请求和消息推送订阅者时才可以淘汰"""
+        return self.active == 0 and self.broadcaster.subscriber_count == 0
+
+    def memory_usage(self):
+        """估算该聊天占用的内存（以解密缓存为主）"""
+        try:
+            return self.chat.messenger.cache_stats()['bytes']
+        except Exception:
+            return 0
+
+    def info(self):
+        return {
+            'chat_id': self.chat_id,
+            'platform': self.platform,
+            'repo_url': self.repo_url,
+            'opened_at': self.opened_at,
+            'last_used': self.last_used,
+            'memory_bytes': self.memory_usage(),
+            'subscribers': self.broadcaster.subscriber_count,
+            'active_requests': self.active
+        }
+
+
+class ChatRegistry:
+    """按平台和仓库地址索引的已打开聊天
+
+    超过数量或内存上限时按最近最少使用（LRU）淘汰空闲的聊天（没有进行中的请求和推送订阅者），
+    被淘汰的会话由调用方负责关闭。所有聊天都在使用时暂时允许超出上限。
+    """
+
+    def __init__(self, max_chats=DEFAULT_MAX_CHATS, max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES):
+        self.max_chats = max_chats
+        self.max_memory_bytes = max_memory_bytes
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_id=None):
+        """获取会话并标记为最近使用；chat_id 为空时返回最近使用的会话"""
+        with self._lock:
+            if chat_id is None:
+                if not self._sessions:
+                    return None
+                chat_id = next(reversed(self._sessions))
+            session = self._sessions.get(chat_id)
+            if session:
+                self._sessions.move_to_end(chat_id)
+                session.last_used = time.time()
+            return session
+
+    def find_local(self, local_name, exclude=None):
+        """使用指定本地目录的会话（chat_id 为 exclude 的除外），没有时返回 None"""
+        with self._lock:
+            return next((session for chat_id, session in self._sessions.items()
+                         if session.local_name == local_name and chat_id != exclude), None)
+
+    def acquire(self, chat_id=None):
+        """与 get 相同，同时把会话标记为使用中，处理完请求后需要调用 release"""
+        with self._lock:
+            session = self.get(chat_id)
+            if session:
+                session.active += 1
+            return session
+
+    def release(self, session):
+        with self._lock:
+            session.active -= 1
+
+    def add(self, session):
+        """登记新会话，返回因超出上限而被淘汰的会话列表"""
+        with self._lock:
+            self._sessions[session.chat_id] = session
+            self._sessions.move_to_end(session.chat_id)
+            return self._evict(keep=session.chat_id)
+
+    def remove(self, chat_id):
+        """移除会话并返回，不存在时返回 None"""
+        with self._lock:
+            return self._sessions.pop(chat_id, None)
+
+    def enforce_limits(self, keep=None):
+        """按当前上限淘汰会话（例如缓存增长之后），keep 指定的会话不会被淘汰"""
+        with self._lock:
+            return self._evict(keep)
+
+    def _evict(self, keep=None):
+        evicted = []
+        # 从最久未使用的会话开始淘汰，最近使用的会话始终保留
+        candidates = [chat_id for chat_id, session in self._sessions.items()
+                      if chat_id != keep and session.is_idle()]
+        for chat_id in candidates:
+            over_count = len(self._sessions) > self.max_chats
+            over_memory = sum(s.memory_usage() for s in self._sessions.values()) > self.max_memory_bytes
+            if not over_count and not over_memory:
+                break
+            evicted.append(self._sessions.pop(chat_id))
+        return evicted
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def stats(self):
+        sessions = self.sessions()
+        return {
+            'open_chats': len(sessions),
+            'max_chats': self.max_chats,
+            'memory_bytes': sum(s.memory_usage() for s in sessions),
+            'max_memory_bytes': self.max_memory_bytes
+        }
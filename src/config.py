@@ -1,6 +1,9 @@
+import copy
 import json
 import os
-from src.crypto.crypto_utils import MessageCrypto
+import threading
+from src.crypto.crypto_utils import MessageCrypto, mnemonic_fingerprint, invalidate_derived_key
+from src import metrics
 from cryptography.fernet import Fernet
 import base64
 
@@ -9,6 +12,50 @@ CONFIG_DIR = os.path.expanduser('~/.gitchat')
 CONFIG_FILE = os.path.join(CONFIG_DIR, 'config.json')
 KEY_FILE = os.path.join(CONFIG_DIR, '.key')
 
+# 已解密配置的内存缓存，按配置文件的修改时间和大小判断是否失效
+_config_cache = {'signature': None, 'config': None, 'snapshot': None}
+_config_fernet = {'signature': None, 'fernet': None}
+_config_lock = threading.RLock()
+
+class FrozenConfig(dict):
+    """只读的配置快照，修改时抛出 TypeError"""
+    
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("配置快照是只读的，需要修改时请使用 load_config() 获取副本")
+    
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = __ior__ = _readonly
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenConfig((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def _file_signature(path):
+    """文件的 (修改时间, 大小)，文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _get_config_fernet():
+    """获取配置加密器，密钥文件不变时复用"""
+    with _config_lock:
+        signature = _file_signature(KEY_FILE)
+        if _config_fernet['fernet'] is None or signature is None or signature != _config_fernet['signature']:
+            _config_fernet['fernet'] = Fernet(get_config_key())
+            _config_fernet['signature'] = _file_signature(KEY_FILE)
+        return _config_fernet['fernet']
+
+def invalidate_config_cache():
+    """清除配置缓存，下次读取时重新解密"""
+    with _config_lock:
+        _config_cache.update(signature=None, config=None, snapshot=None)
+        _config_fernet.update(signature=None, fernet=None)
+
 def get_config_key():
     """获取或创建配置加密密钥"""
     if os.path.exists(KEY_FILE):
@@ -23,8 +70,8 @@ def get_config_key():
         os.chmod(KEY_FILE, 0o600)
         return key
 
-def load_config():
-    """加载并解密配置"""
+def _read_config():
+    """从磁盘读取并解密配置"""
     if not os.path.exists(CONFIG_FILE):
         return {}
     
@@ -37,13 +84,33 @@ def load_config():
             return {}
         
         # 使用配置密钥解密
-        fernet = Fernet(get_config_key())
+        fernet = _get_config_fernet()
         decrypted_bytes = fernet.decrypt(encrypted_data.encode())
         return json.loads(decrypted_bytes.decode('utf-8'))
     except Exception as e:
         print(f"⚠️ 配置文件损坏或被篡改: {str(e)}")
         return {}
 
+def _cached_config():
+    """返回缓存的配置，配置文件变化（修改时间或大小不同）时重新读取"""
+    with _config_lock:
+        signature = _file_signature(CONFIG_FILE)
+        if _config_cache['config'] is None or signature != _config_cache['signature']:
+            with metrics.span('config_load'):
+                config = _read_config()
+            _config_cache.update(signature=signature, config=config, snapshot=_freeze(config))
+        else:
+            metrics.inc('config_cache_hits')
+        return _config_cache
+
+def load_config():
+    """加载并解密配置，返回可以修改的副本"""
+    return copy.deepcopy(_cached_config()['config'])
+
+def get_config_snapshot():
+    """获取只读的配置快照（不复制，适合只读取配置的调用方）"""
+    return _cached_config()['snapshot']
+
 def save_config(config):
     """加密并保存配置"""
     try:
@@ -51,7 +118,7 @@ def save_config(config):
         os.makedirs(CONFIG_DIR, exist_ok=True)
         
         # 加密配置数据
-        fernet = Fernet(get_config_key())
+        fernet = _get_config_fernet()
         encrypted_data = fernet.encrypt(
             json.dumps(config, ensure_ascii=False).encode('utf-8')
         )
@@ -63,6 +130,11 @@ def save_config(config):
         # 设置配置文件权限（仅当前用户可读写）
         os.chmod(CONFIG_FILE, 0o600)
         
+        # 写入缓存，之后的读取不必重新解密
+        config = copy.deepcopy(config)
+        with _config_lock:
+            _config_cache.update(signature=_file_signature(CONFIG_FILE), config=config, snapshot=_freeze(config))
+        
     except Exception as e:
         print(f"❌ 保存配置失败: {str(e)}")
         raise
@@ -279,6 +351,14 @@ def update_config():
     
     return config
 
+def local_repo_name(platform_name, repo_url):
+    """本地仓库目录和本地消息库使用的名称（平台_仓库名）
+
+    不同账号下的同名仓库对应同一个名称，不能同时打开。
+    """
+    repo_name = repo_url.split('/')[-1].replace('.git', '')
+    return f"{platform_name.lower()}_{repo_name}"
+
 def save_recent_repo(platform_name, repo_url, chat_mnemonic=None):
     """保存仓库地址和助记词"""
     config = load_config()
@@ -296,6 +376,37 @@ def save_recent_repo(platform_name, repo_url, chat_mnemonic=None):
             'mnemonic': chat_mnemonic
         }
         save_config(config)
+    else:
+        repo_info = config['repos'][platform_name][repo_url]
+        if chat_mnemonic and repo_info.get('mnemonic') != chat_mnemonic:
+            # 助记词变化后，之前保存的派生密钥必须作废
+            if repo_info.get('mnemonic'):
+                invalidate_derived_key(repo_info['mnemonic'])
+            repo_info['mnemonic'] = chat_mnemonic
+            repo_info.pop('derived_key', None)
+            save_config(config)
+
+def get_chat_key(config, platform_name, repo_url, chat_mnemonic):
+    """读取配置中保存的聊天派生密钥，助记词不匹配时返回 None"""
+    repo_info = config.get('repos', {}).get(platform_name, {}).get(repo_url)
+    if not isinstance(repo_info, dict):
+        return None
+    saved = repo_info.get('derived_key')
+    if not saved or saved.get('fingerprint') != mnemonic_fingerprint(chat_mnemonic):
+        return None
+    return saved.get('key')
+
+def save_chat_key(platform_name, repo_url, chat_mnemonic, key):
+    """将聊天派生密钥保存到（加密的）配置中，下次打开时跳过密钥派生"""
+    config = load_config()
+    repo_info = config.get('repos', {}).get(platform_name, {}).get(repo_url)
+    if not isinstance(repo_info, dict) or repo_info.get('mnemonic') != chat_mnemonic:
+        return
+    repo_info['derived_key'] = {
+        'fingerprint': mnemonic_fingerprint(chat_mnemonic),
+        'key': key.decode('utf-8') if isinstance(key, bytes) else key
+    }
+    save_config(config)
 
 def update_repo_note(platform_name, repo_url, config):
     """更新仓库备注"""
@@ -1,41 +1,102 @@
 from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
 import base64
 import json
 import hashlib
-from mnemonic import Mnemonic
+import hmac
 import os
+import threading
+from src import metrics
+
+# 进程内的派生密钥缓存：助记词指纹 -> Fernet 密钥
+_derived_keys = {}
+_derived_keys_lock = threading.Lock()
+
+def mnemonic_fingerprint(mnemonic_words):
+    """计算助记词的指纹，用于索引派生密钥（不可逆推出助记词）"""
+    return hashlib.sha256(f"sealtext-key:{mnemonic_words}".encode('utf-8')).hexdigest()
+
+def _mnemonic():
+    """中文助记词工具；mnemonic 包加载词表较慢，只在生成、校验或派生密钥时才导入"""
+    from mnemonic import Mnemonic
+    return Mnemonic("chinese_simplified")
+
+def derive_key(mnemonic_words):
+    """从助记词派生 Fernet 密钥，同一进程内只计算一次"""
+    fingerprint = mnemonic_fingerprint(mnemonic_words)
+    with _derived_keys_lock:
+        key = _derived_keys.get(fingerprint)
+    if key:
+        return key
+    
+    # 使用助记词生成密钥
+    mnemo = _mnemonic()
+    if not mnemo.check(mnemonic_words):
+        raise ValueError("无效的助记词")
+    
+    # 从助记词生成种子（PBKDF2-HMAC-SHA512，2048 轮）
+    seed = mnemo.to_seed(mnemonic_words)
+    # 使用种子的前32字节作为密钥
+    key = base64.urlsafe_b64encode(seed[:32])
+    with _derived_keys_lock:
+        _derived_keys[fingerprint] = key
+    return key
+
+def remember_derived_key(mnemonic_words, key):
+    """登记已知的派生密钥（例如从配置中读取），之后不再重新计算"""
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    with _derived_keys_lock:
+        _derived_keys[mnemonic_fingerprint(mnemonic_words)] = key
+
+def invalidate_derived_key(mnemonic_words=None):
+    """清除指定助记词的派生密钥缓存，不指定时清除全部"""
+    with _derived_keys_lock:
+        if mnemonic_words is None:
+            _derived_keys.clear()
+        else:
+            _derived_keys.pop(mnemonic_fingerprint(mnemonic_words), None)
+
+def derive_subkey(key, purpose):
+    """从聊天密钥派生用途专用的子密钥（HMAC-SHA256），返回 Fernet 格式的密钥"""
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    digest = hmac.new(base64.urlsafe_b64decode(key), f"sealtext:{purpose}".encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest)
 
 class MessageCrypto:
-    def __init__(self, mnemonic_words):
+    def __init__(self, mnemonic_words, key=None):
         """
         初始化加密器
         mnemonic_words: 助记词字符串
+        key: 已派生好的密钥（可选），提供时跳过密钥派生
         """
-        # 使用助记词生成密钥
-        mnemo = Mnemonic("chinese_simplified")
-        if not mnemo.check(mnemonic_words):
-            raise ValueError("无效的助记词")
-        
-        # 从助记词生成种子
-        seed = mnemo.to_seed(mnemonic_words)
-        # 使用种子的前32字节作为密钥
-        key = base64.urlsafe_b64encode(seed[:32])
-        self.fernet = Fernet(key)
+        if key:
+            remember_derived_key(mnemonic_words, key)
+        self.key = derive_key(mnemonic_words)
+        self.fernet = Fernet(self.key)
+    
+    @classmethod
+    def from_key(cls, key):
+        """直接使用已派生的密钥创建加密器（例如在解密子进程中）"""
+        crypto = cls.__new__(cls)
+        crypto.key = key
+        crypto.fernet = Fernet(key)
+        return crypto
     
     @staticmethod
     def generate_mnemonic():
         """生成新的助记词"""
-        mnemo = Mnemonic("chinese_simplified")
+        mnemo = _mnemonic()
         return mnemo.generate()
     
     @staticmethod
     def verify_mnemonic(mnemonic_words):
         """验证助记词是否有效"""
-        mnemo = Mnemonic("chinese_simplified")
+        mnemo = _mnemonic()
         return mnemo.check(mnemonic_words)
     
-    def calculate_message_hash(self, message_dict, prev_hash=None):
+    @staticmethod
+    def calculate_message_hash(message_dict, prev_hash=None):
         """计算消息的哈希值"""
         hash_content = {
             'content': message_dict['content'],
@@ -56,15 +117,18 @@ class MessageCrypto:
         message_bytes = json.dumps(message_dict, ensure_ascii=False).encode('utf-8')
         return self.fernet.encrypt(message_bytes).decode('utf-8')
     
-    def decrypt_message(self, encrypted_message):
-        """解密消息并验证哈希值"""
+    def decrypt_message(self, encrypted_message, verify=True):
+        """解密消息并验证哈希值，verify 为 False 时跳过哈希验证（用于已验证过的消息）"""
         try:
-            decrypted_bytes = self.fernet.decrypt(encrypted_message.encode('utf-8'))
-            message_dict = json.loads(decrypted_bytes.decode('utf-8'))
+            with metrics.span('decrypt'):
+                decrypted_bytes = self.fernet.decrypt(encrypted_message.encode('utf-8'))
+                message_dict = json.loads(decrypted_bytes.decode('utf-8'))
             
-            calculated_hash = self.calculate_message_hash(message_dict, message_dict.get('prev_hash'))
-            if calculated_hash != message_dict.get('hash'):
-                raise ValueError("消息哈希验证失败，消息可能被篡改")
+            if verify:
+                with metrics.span('verify'):
+                    calculated_hash = self.calculate_message_hash(message_dict, message_dict.get('prev_hash'))
+                if calculated_hash != message_dict.get('hash'):
+                    raise ValueError("消息哈希验证失败，消息可能被篡改")
             
             return message_dict
         except Exception as e:
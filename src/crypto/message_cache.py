@@ -0,0 +1,88 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 默认缓存上限 32MB
+DEFAULT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# 每个缓存条目的固定开销估算（字典、键、OrderedDict 节点等）
+_ENTRY_OVERHEAD = 256
+
+
+def _estimate_size(message_dict):
+    """粗略估算已解密消息占用的内存"""
+    size = _ENTRY_OVERHEAD
+    for key, value in message_dict.items():
+        size += len(key) + 50
+        if isinstance(value, str):
+            # 中文字符在 CPython 中按 2~4 字节存储，这里统一按 2 字节估算
+            size += len(value) * 2 + 50
+    return size
+
+
+class DecryptedMessageCache:
+    """已解密并通过验证的消息缓存
+
+    以密文的 SHA-256 摘要为键，按 LRU 策略淘汰，总占用不超过 max_bytes。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(encrypted_message):
+        return hashlib.sha256(encrypted_message.encode('utf-8')).digest()
+
+    def get(self, encrypted_message):
+        """查找缓存，命中时返回消息副本，未命中返回 None"""
+        key = self._key(encrypted_message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # 返回副本，避免调用方修改缓存内容
+            return dict(entry[0])
+
+    def put(self, encrypted_message, message_dict):
+        """写入一条已验证的消息"""
+        size = _estimate_size(message_dict)
+        if size > self.max_bytes:
+            return
+        key = self._key(encrypted_message)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (dict(message_dict), size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存（计数器保留）"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
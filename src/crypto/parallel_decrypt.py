@@ -0,0 +1,107 @@
+import logging
+import os
+from itertools import repeat
+
+from src.crypto.crypto_utils import MessageCrypto
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+# 每个子任务解密的消息数
+DEFAULT_CHUNK_SIZE = 256
+# 待解密消息少于该数量时直接在当前进程串行解密，避免进程间通信的开销
+DEFAULT_PARALLEL_THRESHOLD = 1000
+# 默认最多使用的子进程数
+DEFAULT_MAX_WORKERS = 4
+
+# 子进程中的加密器，由进程池初始化函数创建
+_worker_crypto = None
+
+
+def _init_worker(key, record_metrics=False):
+    global _worker_crypto
+    _worker_crypto = MessageCrypto.from_key(key)
+    metrics.enable(record_metrics)
+
+
+def _decrypt_chunk(encrypted_messages, verify=True):
+    """在子进程中解密一批消息，失败的消息返回错误信息而不是抛出异常
+
+    子进程中记录的解密和验证耗时随结果一起返回，由父进程合并。
+    """
+    results = []
+    for encrypted_message in encrypted_messages:
+        try:
+            results.append((True, _worker_crypto.decrypt_message(encrypted_message, verify)))
+        except ValueError as e:
+            results.append((False, str(e)))
+    return results, metrics.drain()
+
+
+class ParallelDecryptor:
+    """多进程解密和验证
+
+    将密文切分成块交给进程池处理（Fernet 的 AES/HMAC 与 JSON 解析在同一进程内会争用 GIL），
+    结果按原顺序返回，供调用方继续校验哈希链。消息较少时退回串行解密。
+    """
+
+    def __init__(self, crypto, max_workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 parallel_threshold=DEFAULT_PARALLEL_THRESHOLD):
+        self.crypto = crypto
+        self.max_workers = max_workers or min(os.cpu_count() or 1, DEFAULT_MAX_WORKERS)
+        self.chunk_size = max(1, chunk_size)
+        self.parallel_threshold = parallel_threshold
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            # multiprocessing 只在第一次并行解密时导入
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # 使用 spawn 启动子进程：Web 服务端是多线程的，fork 可能复制其他线程持有的锁（日志、指标），
+            # 子进程获取这些锁时会死锁，而同步线程此时还持有仓库锁
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.crypto.key, metrics.is_enabled())
+            )
+        return self._pool
+
+    def _decrypt_serial(self, encrypted_messages, verify=True):
+        results = []
+        for encrypted_message in encrypted_messages:
+            try:
+                results.append(self.crypto.decrypt_message(encrypted_message, verify))
+            except ValueError as e:
+                results.append(e)
+        return results
+
+    def decrypt(self, encrypted_messages, verify=True):
+        """按顺序解密并验证消息，返回列表中每项为消息字典或 ValueError"""
+        encrypted_messages = list(encrypted_messages)
+        if self.max_workers <= 1 or len(encrypted_messages) < self.parallel_threshold:
+            return self._decrypt_serial(encrypted_messages, verify)
+
+        chunks = [encrypted_messages[i:i + self.chunk_size]
+                  for i in range(0, len(encrypted_messages), self.chunk_size)]
+        try:
+            # map 保证结果顺序与输入一致
+            chunk_results = list(self._get_pool().map(_decrypt_chunk, chunks, repeat(verify)))
+        except Exception as e:
+            # 进程池不可用（例如受限环境）时退回串行解密
+            logger.warning(f"并行解密失败，改为串行解密: {str(e)}")
+            self.close()
+            return self._decrypt_serial(encrypted_messages, verify)
+
+        results = []
+        for chunk, worker_metrics in chunk_results:
+            metrics.merge(worker_metrics)
+            for ok, value in chunk:
+                results.append(value if ok else ValueError(value))
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
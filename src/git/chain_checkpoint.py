@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+
+import git
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = 'sealtext-checkpoints.json'
+
+
+class ChainCheckpoints:
+    """各消息文件已验证前缀的本地检查点
+
+    记录每个日志文件已通过哈希链验证的消息数、最后一条消息的哈希，以及验证时的提交和文件 blob。
+    之后只要该提交仍是 HEAD 的祖先、并且此后对该文件的改动只有追加，前缀就无需重新验证；
+    历史被改写或文件中间被修改时检查点失效，回到完整验证。
+    检查点保存在仓库的 .git 目录中，不会被提交或推送。
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.path = os.path.join(repo.git_dir, CHECKPOINT_FILE)
+        self._entries = None
+        self._dirty = False
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    @staticmethod
+    def _blob(commit, file_name):
+        try:
+            return commit.tree[file_name].hexsha
+        except KeyError:
+            return None
+
+    def trusted_prefix(self, file_name, head):
+        """返回可信前缀 (消息数, 最后一条消息的哈希)，检查点无效时返回 None"""
+        entry = self._load().get(file_name)
+        if not entry:
+            return None
+        try:
+            head_commit = self.repo.commit(head)
+            if self._blob(head_commit, file_name) != entry['blob']:
+                # 文件有变化：检查点提交必须仍在当前历史中，且此后只追加了内容
+                if not self.repo.is_ancestor(entry['commit'], head):
+                    raise ValueError("检查点提交不在当前历史中")
+                if self._blob(self.repo.commit(entry['commit']), file_name) != entry['blob']:
+                    raise ValueError("检查点记录的文件版本不一致")
+                numstat = self.repo.git.diff('--numstat', entry['commit'], head, '--', file_name)
+                for line in numstat.splitlines():
+                    deleted = line.split('\t')[1]
+                    if deleted != '0':
+                        raise ValueError("已验证的内容被修改")
+        except (ValueError, IndexError, git.exc.GitCommandError, git.exc.BadName) as e:
+            logger.warning(f"文件 {file_name} 的验证检查点失效，重新完整验证: {str(e)}")
+            self.discard(file_name)
+            return None
+        return entry['count'], entry['last_hash']
+
+    def record(self, file_name, head, count, last_hash):
+        """记录文件在提交 head 时已验证的前缀"""
+        entries = self._load()
+        entry = entries.get(file_name)
+        if entry and entry['count'] == count and entry['last_hash'] == last_hash:
+            return
+        blob = self._blob(self.repo.commit(head), file_name)
+        if not blob:
+            return
+        entries[file_name] = {'count': count, 'last_hash': last_hash, 'commit': head, 'blob': blob}
+        self._dirty = True
+
+    def discard(self, file_name):
+        if self._load().pop(file_name, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        """有变化时写回检查点文件"""
+        if not self._dirty:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            logger.warning(f"保存验证检查点失败: {str(e)}")
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSnapshot:
+    """某一时刻已解密消息的只读快照
+
+    messages 为按时间排序的消息元组，index 为消息哈希到下标的映射。
+    快照创建后不再修改，读取方可以直接共享，不要修改其中的消息字典。
+    """
+
+    __slots__ = ('messages', 'index', 'version', 'synced_at')
+
+    def __init__(self, messages=(), version=0, synced_at=None):
+        self.messages = tuple(messages)
+        self.index = {msg['hash']: i for i, msg in enumerate(self.messages) if msg.get('hash')}
+        self.version = version
+        self.synced_at = synced_at
+
+
+class ChatSyncer:
+    """每个聊天一个的后台同步器
+
+    按固定间隔拉取并解密新消息，失败时指数退避；最新结果保存在只读快照中，
+    读取方直接使用快照。同时请求同步的调用方共享同一次正在进行的拉取。
+    """
+
+    def __init__(self, messenger, interval=5.0, max_backoff=300.0):
+        self.messenger = messenger
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._snapshot = ChatSnapshot()
+        self._listeners = []
+        self._snapshot_listeners = []
+        self._publish_lock = threading.Lock()
+        # 读取消息列表到发布快照之间持有，同步和加载历史按读取顺序发布，较早读取的列表不会覆盖较新的
+        self._read_lock = threading.Lock()
+        self._cond = threading.Condition()
+        # 排队中尚未开始的同步，以及正在进行的同步
+        self._queued = None
+        self._running = None
+        self._thread = None
+        self._stopped = False
+        self._failures = 0
+        self._delay = interval
+
+    @property
+    def snapshot(self):
+        """当前快照（O(1)，不触发同步）"""
+        return self._snapshot
+
+    def add_listener(self, callback):
+        """注册新消息回调 callback(new_messages, snapshot)，在同步线程中调用"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+    
+    def add_snapshot_listener(self, callback):
+        """注册快照回调 callback(snapshot)，每次快照更新（包括首次同步和加载历史）后调用"""
+        self._snapshot_listeners.append(callback)
+
+    def start(self):
+        """启动后台同步线程"""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._loop, name="ChatSyncer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """停止后台同步线程"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def request_sync(self, fresh=False):
+        """请求立即同步，返回结果为快照的 Future
+
+        已有同步在排队或进行时直接返回同一个 Future；fresh 为 True 时不复用
+        正在进行的同步（它可能开始于调用方的写入之前），而是排队等待下一次。
+        后台线程未运行时在当前线程同步。
+        """
+        with self._cond:
+            if self._queued is not None:
+                return self._queued
+            if self._running is not None and not fresh:
+                return self._running
+            future = Future()
+            if self._thread and self._thread.is_alive():
+                self._queued = future
+                self._cond.notify_all()
+                return future
+            self._running = future
+        self._run(future)
+        return future
+
+    def sync(self, timeout=None, fresh=False):
+        """同步并返回最新快照"""
+        return self.request_sync(fresh).result(timeout)
+
+    def load_older(self, count=1):
+        """加载更早的 count 个分段并发布快照（不作为新消息推送），返回新的快照"""
+        with self._read_lock:
+            return self.publish(self.messenger.load_older_segments(count), notify=False)
+
+    def publish(self, messages, notify=True):
+        """用新的消息列表替换快照，notify 为 True 时通知监听者新增的消息"""
+        with self._publish_lock:
+            previous = self._snapshot
+            snapshot = ChatSnapshot(messages, previous.version + 1, time.time())
+            self._snapshot = snapshot
+            # 快照回调按版本顺序执行
+            for callback in list(self._snapshot_listeners):
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    logger.error(f"快照回调失败: {str(e)}")
+        if not notify or previous.version == 0:
+            # 首次同步得到的是历史消息，不作为新消息推送
+            return snapshot
+        # 解密失败的占位消息没有哈希，不推送
+        new_messages = [msg for msg in snapshot.messages
+                        if msg.get('hash') and msg['hash'] not in previous.index]
+        if new_messages:
+            for callback in list(self._listeners):
+                try:
+                    callback(new_messages, snapshot)
+                except Exception as e:
+                    logger.error(f"新消息回调失败: {str(e)}")
+        return snapshot
+
+    def _run(self, future):
+        """执行一次同步并完成 future"""
+        try:
+            with self._read_lock:
+                snapshot = self.publish(self.messenger.receive_messages())
+        except Exception as e:
+            self._failures += 1
+            self._delay = min(self.interval * (2 ** self._failures), self.max_backoff)
+            logger.error(f"同步消息失败，{self._delay:.0f} 秒后重试: {str(e)}")
+            with self._cond:
+                if self._running is future:
+                    self._running = None
+            future.set_exception(e)
+        else:
+            self._failures = 0
+            self._delay = self.interval
+            with self._cond:
+                if self._running is future:
+                    self._running = None
+            future.set_result(snapshot)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._queued is None and not self._stopped:
+                    self._cond.wait(self._delay)
+                if self._stopped:
+                    # 唤醒仍在等待的调用方
+                    if self._queued is not None:
+                        self._queued.cancel()
+                        self._queued = None
+                    return
+                future = self._queued or Future()
+                self._queued = None
+                self._running = future
+            self._run(future)
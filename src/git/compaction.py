@@ -0,0 +1,241 @@
+"""聊天仓库压缩
+
+每条消息都会产生提交，仓库的对象数和打包体积随聊天增长，拉取和克隆越来越慢。
+压缩把当前所有文件放进一个没有父提交的新快照提交，替换远程的 main 分支；
+压缩前的历史保存到归档引用（refs/archive/compaction-<代数>）或本地 bundle 文件中。
+归档引用不在 refs/heads 下，默认的克隆和拉取不会下载它，需要时可以单独获取：
+git fetch origin refs/archive/compaction-1:refs/archive/compaction-1
+
+消息文件的内容在压缩前后完全相同，哈希链照常验证。快照中的标记文件记录压缩的代数，
+其他参与者拉取时发现远程的代数更大，就改用新的历史，并把本地尚未推送的消息追加回去。
+推送新历史时使用 --force-with-lease，压缩期间远程有新提交则放弃本次压缩。
+
+用法：python -m src.git.compaction <本地仓库路径> [--archive branch|bundle] [--bundle 路径]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+import git
+
+from src.git import message_log, object_commit
+
+logger = logging.getLogger(__name__)
+
+# 压缩标记文件，记录压缩代数和归档位置
+MARKER_FILE = '.sealtext-compaction.json'
+# 归档引用不在 refs/heads 下，克隆和拉取默认只获取分支，不会下载归档的历史
+ARCHIVE_PREFIX = 'refs/archive/compaction-'
+# 自上次压缩以来的提交数少于该值时不压缩
+DEFAULT_MIN_COMMITS = 1000
+
+
+def read_marker(repo, rev='HEAD'):
+    """读取指定提交中的压缩标记，没有压缩过时代数为 0"""
+    try:
+        return json.loads(repo.git.show(f'{rev}:{MARKER_FILE}'))
+    except (git.exc.GitCommandError, ValueError):
+        return {'generation': 0}
+
+
+def commits_since_compaction(repo, rev='HEAD'):
+    """自上次压缩（即根提交）以来的提交数"""
+    return int(repo.git.rev_list('--count', rev))
+
+
+def _has_origin(repo):
+    return any(remote.name == 'origin' for remote in repo.remotes)
+
+
+def compact(repo, archive='branch', bundle_path=None, author=None, push=True, min_commits=0):
+    """压缩仓库历史，返回压缩结果；提交数不足 min_commits 时不压缩并返回 None"""
+    if repo.bare:
+        raise ValueError("裸仓库没有工作区，请在普通克隆中压缩")
+    push = push and _has_origin(repo)
+    if push:
+        pull_compacted(repo)
+
+    commit_count = commits_since_compaction(repo)
+    if commit_count < max(min_commits, 2):
+        logger.info(f"只有 {commit_count} 个提交，无需压缩")
+        return None
+
+    base = repo.head.commit.hexsha
+    generation = read_marker(repo).get('generation', 0) + 1
+    archive_ref = None
+    if archive == 'bundle':
+        if not bundle_path:
+            repo_dir = repo.working_tree_dir.rstrip(os.sep)
+            bundle_path = f"{repo_dir}-compaction-{generation}.bundle"
+        repo.git.bundle('create', bundle_path, 'main')
+        logger.info(f"压缩前的历史已保存到 {bundle_path}")
+    elif archive == 'branch':
+        archive_ref = f'{ARCHIVE_PREFIX}{generation}'
+        repo.git.update_ref(archive_ref, base)
+        if push:
+            repo.git.push('origin', f'{archive_ref}:{archive_ref}')
+        logger.info(f"压缩前的历史已保存到 {archive_ref}")
+    else:
+        raise ValueError(f"不支持的归档方式: {archive}")
+
+    marker = {
+        'generation': generation,
+        'base': base,
+        'archive': archive_ref or os.path.basename(bundle_path),
+        'compacted_at': datetime.now().isoformat(),
+        'compacted_by': author,
+        'commits': commit_count
+    }
+    with open(os.path.join(repo.working_tree_dir, MARKER_FILE), 'w', encoding='utf-8', newline='\n') as f:
+        json.dump(marker, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    repo.git.add(MARKER_FILE)
+
+    # 以当前的文件树创建没有父提交的快照提交
+    tree = repo.git.write_tree()
+    snapshot = repo.git.commit_tree(tree, '-m', f'Compact history (generation {generation})')
+    if push:
+        try:
+            repo.git.push('origin', f'{snapshot}:refs/heads/main', f'--force-with-lease=refs/heads/main:{base}')
+        except git.exc.GitCommandError as e:
+            repo.git.reset('--hard', base)
+            raise RuntimeError(f"远程仓库在压缩期间有新的提交，请稍后重试: {str(e)}")
+    repo.git.reset('--hard', snapshot)
+    if push:
+        repo.remotes.origin.fetch()
+
+    logger.info(f"已将 {commit_count} 个提交压缩为快照提交 {snapshot[:8]}")
+    return dict(marker, snapshot=snapshot, bundle=bundle_path)
+
+
+def _message_blobs(commit):
+    """提交中所有消息文件的内容"""
+    return {blob.path: blob.data_stream.read() for blob in commit.tree.blobs
+            if message_log.is_message_file(blob.path)}
+
+
+def _shared_paths(repo, marker, remote_ref):
+    """本地与远程共同祖先中的文件名，无法确定共同祖先时返回 None
+
+    优先使用压缩基准提交（压缩前的 main），本地没有该提交时使用本次获取之前的远程跟踪分支。
+    """
+    for rev in (marker.get('base'), f'{remote_ref}@{{1}}'):
+        if not rev:
+            continue
+        try:
+            bases = repo.merge_base(repo.head.commit, rev)
+        except git.exc.GitCommandError:
+            continue
+        if bases:
+            return {blob.path for blob in bases[0].tree.blobs}
+    return None
+
+
+def adopt_compaction(repo, remote_ref='origin/main'):
+    """远程历史已被压缩（代数更大）时改用远程的新历史
+
+    本地消息文件中在远程快照之后追加的内容（尚未推送的消息）会重新提交。
+    远程快照中没有的文件视为已被删除（例如已迁移的旧格式文件），除非它是与远程分叉之后本地新建的文件。
+    远程没有被压缩时返回 False。
+    """
+    remote_marker = read_marker(repo, remote_ref)
+    if remote_marker.get('generation', 0) <= read_marker(repo).get('generation', 0):
+        return False
+
+    remote_blobs = _message_blobs(repo.commit(remote_ref))
+    shared_paths = _shared_paths(repo, remote_marker, remote_ref)
+    pending = {}
+    for path, data in _message_blobs(repo.head.commit).items():
+        remote_data = remote_blobs.get(path)
+        if remote_data is None:
+            # 与远程的共同祖先中已有的文件是被远程删除的；不能确定时按删除处理
+            if shared_paths is not None and path not in shared_paths:
+                pending[path] = data
+        elif data != remote_data and data.startswith(remote_data):
+            pending[path] = data
+
+    logger.warning("远程仓库历史已被压缩，切换到新的历史")
+    if repo.bare:
+        # 裸仓库直接在远程快照上提交未推送的内容
+        remote, local = repo.commit(remote_ref), repo.head.commit
+        if pending:
+            object_commit.commit_files(repo, pending, 'Replay messages after compaction', remote, expected=local)
+            logger.info(f"已重新提交 {len(pending)} 个文件中未推送的消息")
+        else:
+            object_commit.update_ref(repo, remote.hexsha, local.hexsha)
+        return True
+    repo.git.reset('--hard', remote_ref)
+    if pending:
+        for path, data in pending.items():
+            with open(os.path.join(repo.working_tree_dir, path), 'wb') as f:
+                f.write(data)
+        repo.git.add('--', *pending)
+        repo.index.commit('Replay messages after compaction')
+        logger.info(f"已重新提交 {len(pending)} 个文件中未推送的消息")
+    return True
+
+
+def pull_compacted(repo):
+    """拉取远程更改，远程历史被压缩时改用新的历史"""
+    origin = repo.remotes.origin
+    if repo.bare:
+        # 裸仓库不能 pull，获取后在对象库中合并
+        origin.fetch()
+        if not adopt_compaction(repo):
+            object_commit.integrate(repo)
+        return
+    try:
+        origin.pull()
+    except git.exc.GitCommandError:
+        # 历史无关导致合并失败时，检查是否为压缩
+        if not adopt_compaction(repo):
+            raise
+
+
+def merge_fetched(repo, remote_name):
+    """合并已获取的远程 main 分支，远程历史被压缩时改用新的历史"""
+    remote_ref = f'{remote_name}/main'
+    if repo.bare:
+        if not adopt_compaction(repo, remote_ref):
+            object_commit.integrate(repo, f'refs/remotes/{remote_ref}')
+        return
+    try:
+        repo.git.merge('--no-edit', remote_ref)
+    except git.exc.GitCommandError:
+        if not adopt_compaction(repo, remote_ref):
+            raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='压缩聊天仓库的历史')
+    parser.add_argument('repo_path', help='本地聊天仓库路径')
+    parser.add_argument('--archive', choices=['branch', 'bundle'], default='branch',
+                        help='压缩前历史的保存方式：推送到归档引用 refs/archive/，或保存为本地 bundle 文件')
+    parser.add_argument('--bundle', help='bundle 文件路径（默认保存在仓库目录旁）')
+    parser.add_argument('--min-commits', type=int, default=DEFAULT_MIN_COMMITS,
+                        help='自上次压缩以来的提交数少于该值时不压缩')
+    parser.add_argument('--no-push', action='store_true', help='只压缩本地仓库，不推送')
+    parser.add_argument('--gc', action='store_true', help='压缩后清理本地不再引用的对象')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        repo = git.Repo(os.path.expanduser(args.repo_path))
+        author = repo.config_reader().get_value('user', 'name', None)
+        result = compact(repo, args.archive, args.bundle, author, not args.no_push, args.min_commits)
+    except Exception as e:
+        print(f"❌ 压缩失败: {str(e)}")
+        sys.exit(1)
+    if not result:
+        return
+    if args.gc:
+        repo.git.reflog('expire', '--expire=now', '--all')
+        repo.git.gc('--prune=now')
+    print(f"✅ 已将 {result['commits']} 个提交压缩为第 {result['generation']} 代快照，历史保存在 {result['archive']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 连接检查成功的结果在该时间（秒）内复用
+DEFAULT_CHECK_TTL = 300.0
+
+# 各平台的连通性检查地址
+_CHECK_URLS = {
+    'GitHub': 'https://api.github.com',
+    'Gitee': 'https://gitee.com/api/v5/user'
+}
+# Gitee 没有令牌时只检查站点是否可访问
+_GITEE_HOME = 'https://gitee.com'
+
+# 进程内共享：每个平台一个连接池，检查结果按 (平台, 令牌指纹) 缓存
+_sessions = {}
+_results = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="connectivity")
+
+
+def platform_of(remote_url):
+    """根据仓库地址判断 Git 平台"""
+    if 'github.com' in remote_url:
+        return 'GitHub'
+    if 'gitee.com' in remote_url:
+        return 'Gitee'
+    raise ValueError("不支持的Git服务商，目前仅支持GitHub和Gitee")
+
+
+def get_session(platform):
+    """获取平台共享的 HTTP 会话（连接池和重试策略只创建一次）"""
+    with _lock:
+        session = _sessions.get(platform)
+        if session is None:
+            # requests 导入较慢，第一次检查连接时（在后台线程中）才导入
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            session = requests.Session()
+            retries = Retry(total=3, backoff_factor=0.5)
+            session.mount('https://', HTTPAdapter(max_retries=retries))
+            _sessions[platform] = session
+        return session
+
+
+def _cache_key(platform, token):
+    fingerprint = hashlib.sha256(token.encode('utf-8')).hexdigest()[:16] if token else None
+    return platform, fingerprint
+
+
+def check_connection(remote_url, token=None, ttl=DEFAULT_CHECK_TTL):
+    """检查与 Git 服务器的连接，ttl 内成功过的检查直接返回 True"""
+    try:
+        platform = platform_of(remote_url)
+        key = _cache_key(platform, token if platform == 'Gitee' else None)
+        with _lock:
+            checked_at = _results.get(key)
+        if checked_at is not None and time.monotonic() - checked_at < ttl:
+            return True
+
+        session = get_session(platform)
+        if platform == 'Gitee':
+            # Gitee API需要带上token才能访问
+            if token:
+                response = session.get(_CHECK_URLS['Gitee'], headers={'Authorization': f'token {token}'}, timeout=10)
+            else:
+                response = session.get(_GITEE_HOME, timeout=10)
+        else:
+            response = session.get(_CHECK_URLS[platform], timeout=10)
+        response.raise_for_status()
+
+        with _lock:
+            _results[key] = time.monotonic()
+        return True
+    except Exception as e:
+        logger.error(f"Git服务器连接测试失败: {str(e)}")
+        return False
+
+
+def check_in_background(check, *args):
+    """在后台线程中执行连接检查，返回结果为 bool 的 Future"""
+    return _executor.submit(check, *args)
+
+
+def invalidate(platform=None):
+    """清除连接检查缓存（例如网络变化后）"""
+    with _lock:
+        if platform is None:
+            _results.clear()
+        else:
+            for key in [key for key in _results if key[0] == platform]:
+                del _results[key]
@@ -1,48 +1,121 @@
 import os
-import git
 import json
 from datetime import datetime
 import time
 import sys
-from src.git.git_messenger import GitMessenger
+from bisect import bisect_left, bisect_right
+from src.git.chat_sync import ChatSyncer
+from src.git.connectivity import DEFAULT_CHECK_TTL, platform_of
+from src.git.mirrors import DEFAULT_PUSH_QUORUM
+from src.crypto.parallel_decrypt import DEFAULT_CHUNK_SIZE, DEFAULT_PARALLEL_THRESHOLD
+from src.store.message_store import (
+    MessageStore, DEFAULT_STORE_DIR, InvalidCursorError, store_path, timestamp_cursor
+)
+from src.store.search_index import matches
 from src.config import (
     load_config, 
+    get_config_snapshot,
     save_config, 
     setup_config, 
     update_config, 
     save_recent_repo,
-    get_repo_url
+    get_repo_url,
+    get_chat_key,
+    save_chat_key,
+    local_repo_name
 )
-from src.crypto.crypto_utils import MessageCrypto
-from rich.console import Console
-from rich.text import Text
+from src.crypto.crypto_utils import MessageCrypto, derive_key
+from src import metrics
+
+# 命令行默认显示最新的消息条数
+DEFAULT_DISPLAY_LIMIT = 200
 
 class GitChat:
     def __init__(self, repo_url, platform_name, username=None, token=None, chat_mnemonic=None):
         self.repo_url = repo_url
         self.platform_name = platform_name
         self.username = username  # 添加用户名属性
-        self.config = load_config()  # 保存配置到实例变量
+        self.config = get_config_snapshot()  # 保存配置到实例变量（只读快照）
         self.local_path = self.config.get('repo_path', os.path.expanduser('~/.gitchat/repos'))
         self.messenger = None
+        self.store = None
         self._setup_repo(username, token, chat_mnemonic)
+        # 同步器保存最新的消息快照，并让并发的同步请求共享同一次拉取
+        self.syncer = ChatSyncer(self.messenger, self.config.get('sync_interval', 5))
+        if self.store:
+            # 每次同步后把新消息写入本地消息库
+            self.syncer.add_snapshot_listener(self.store.apply_snapshot)
+        from rich.console import Console
         self.console = Console()  # 初始化rich控制台
     
     def _setup_repo(self, username, token, chat_mnemonic):
         try:
-            repo_name = self.repo_url.split('/')[-1].replace('.git', '')
-            repo_path = os.path.join(self.local_path, f"{self.platform_name.lower()}_{repo_name}")
+            repo_path = os.path.join(self.local_path, local_repo_name(self.platform_name, self.repo_url))
             
             if not chat_mnemonic:
                 print("❌ 未找到聊天助记词！")
                 sys.exit(1)
             
-            self.messenger = GitMessenger(repo_path, self.repo_url, username, token, chat_mnemonic)
+            # 优先使用配置中保存的派生密钥，跳过耗时的密钥派生
+            chat_key = get_chat_key(self.config, self.platform_name, self.repo_url, chat_mnemonic)
+            if not chat_key:
+                chat_key = derive_key(chat_mnemonic)
+                if self.config.get('persist_chat_key', True):
+                    save_chat_key(self.platform_name, self.repo_url, chat_mnemonic, chat_key)
+            
+            # GitPython 导入较慢，选择聊天之后才加载，命令行可以更快显示第一个提示
+            from src.git.git_messenger import GitMessenger, DEFAULT_JOIN_DEPTH
+            
+            # 解密缓存上限（MB），可在配置中通过 message_cache_mb 调整
+            cache_mb = self.config.get('message_cache_mb')
+            self.messenger = GitMessenger(
+                repo_path, self.repo_url, username, token, chat_mnemonic,
+                cache_max_bytes=int(cache_mb * 1024 * 1024) if cache_mb else None,
+                recent_segments=self.config.get('recent_segments'),
+                batch_window=self.config.get('send_batch_window', 0.5),
+                remote_probe_ttl=self.config.get('remote_probe_ttl', 2.0),
+                chat_key=chat_key,
+                decrypt_workers=self.config.get('decrypt_workers'),
+                decrypt_chunk_size=self.config.get('decrypt_chunk_size', DEFAULT_CHUNK_SIZE),
+                parallel_threshold=self.config.get('decrypt_parallel_threshold', DEFAULT_PARALLEL_THRESHOLD),
+                join_mode=self.config.get('join_mode', 'full'),
+                join_depth=self.config.get('join_depth', DEFAULT_JOIN_DEPTH),
+                connection_ttl=self.config.get('connection_check_ttl', DEFAULT_CHECK_TTL),
+                bare=self.config.get('bare_repo', False),
+                mirror_urls=self._mirror_urls(),
+                push_quorum=self.config.get('mirror_push_quorum', DEFAULT_PUSH_QUORUM)
+            )
             print("✅ 仓库连接成功！")
             print(f"📂 本地仓库路径: {repo_path}")
         except Exception as e:
             print(f"❌ 仓库连接失败: {str(e)}")
             sys.exit(1)
+        self.store = self._open_store(chat_key)
+    
+    def _mirror_urls(self):
+        """配置中当前聊天的镜像地址，按镜像所在平台加入认证信息"""
+        urls = []
+        for url in self.config.get('mirrors', {}).get(self.repo_url, ()):
+            try:
+                platform = self.config.get('platforms', {}).get(platform_of(url), {})
+            except ValueError:
+                # 其他 Git 服务的镜像按原样使用
+                platform = {}
+            if url.startswith('https://') and platform.get('username') and platform.get('token'):
+                url = url.replace('https://', f"https://{platform['username']}:{platform['token']}@", 1)
+            urls.append(url)
+        return urls
+    
+    def _open_store(self, chat_key):
+        """打开本地加密消息库，可在配置中通过 message_store 关闭"""
+        if not self.config.get('message_store', True):
+            return None
+        try:
+            path = store_path(self.config.get('store_path', DEFAULT_STORE_DIR), self.platform_name, self.repo_url)
+            return MessageStore(path, chat_key)
+        except Exception as e:
+            print(f"⚠️ 本地消息库不可用，将直接读取仓库: {str(e)}")
+            return None
     
     def send_message(self, message, author):
         try:
@@ -53,15 +126,154 @@ class GitChat:
             print(f"❌ 消息发送失败: {str(e)}")
             return False
     
-    def get_messages(self):
-        try:
-            return self.messenger.receive_messages()
-        except Exception as e:
-            print(f"❌ 获取消息失败: {str(e)}")
-            return []
+    def enqueue_message(self, message, author):
+        """将消息加入发送队列，不等待发送完成，返回 Future（发送失败时带有异常）"""
+        return self.messenger.enqueue_message(message, author)
     
-    def display_messages(self):
+    def start_sync(self):
+        """启动后台同步，之后的读取直接使用内存快照"""
+        self.syncer.start()
+        self.syncer.request_sync()
+    
+    def close(self):
+        """关闭聊天，停止后台同步并等待发送队列中的消息发送完成"""
+        self.syncer.stop()
+        if self.messenger:
+            self.messenger.close()
+        if self.store:
+            self.store.close()
+    
+    def _get_snapshot(self, fresh):
+        """获取消息快照，fresh 为 True 或尚未同步过时先同步一次"""
+        snapshot = self.syncer.snapshot
+        if fresh or snapshot.version == 0:
+            try:
+                snapshot = self.syncer.sync()
+            except Exception as e:
+                print(f"❌ 获取消息失败: {str(e)}")
+        return snapshot
+    
+    def get_messages(self, fresh=True):
+        """获取所有消息；fresh 为 False 时直接返回后台同步的快照"""
+        return list(self._get_snapshot(fresh).messages)
+    
+    def get_messages_page(self, since=None, before=None, limit=None, fresh=False, author=None):
+        """按游标分页获取消息
+        
+        since: 返回该游标之后的新消息；before: 返回该游标之前的历史消息；
+        都不指定时返回最新的 limit 条。游标为消息哈希，也可以是 ISO 格式的时间戳。
+        author 只返回该作者的消息。
+        默认直接读取本地消息库或后台同步的快照，不触发拉取。
+        """
+        if self.store is not None and not fresh and self.store.populated:
+            try:
+                page = self.store.page(since, before, limit, author)
+            except InvalidCursorError:
+                # 游标可能是未加载分段中的消息，改从仓库加载
+                if not self.messenger.has_older_segments():
+                    raise
+                page = None
+            # 库中的历史不足一页且仓库还有未加载的分段时，改从仓库加载（加载结果会写入库中）
+            if page is not None and not (before is not None and limit and len(page['messages']) < limit
+                                         and self.messenger.has_older_segments()):
+                if not page['has_more_before'] and since is None:
+                    page['has_more_before'] = self.messenger.has_older_segments()
+                return page
+        
+        snapshot = self._get_snapshot(fresh)
+        if before is not None:
+            # 游标不在已加载的消息中或已加载的历史不足一页时，按需加载更早的分段
+            while self.messenger.has_older_segments():
+                try:
+                    loaded = _cursor_index(snapshot.messages, before, inclusive=True, index=snapshot.index)
+                except InvalidCursorError:
+                    loaded = None
+                if loaded is not None and (not limit or loaded >= limit):
+                    break
+                snapshot = self.syncer.load_older()
+        
+        if author:
+            messages = [msg for msg in snapshot.messages if msg.get('author') == author]
+            page = paginate_messages(messages, since, before, limit)
+        else:
+            page = paginate_messages(snapshot.messages, since, before, limit, snapshot.index)
+        if not page['has_more_before'] and since is None:
+            page['has_more_before'] = self.messenger.has_older_segments()
+        return page
+    
+    def search_messages(self, query, limit=20, offset=0, author=None):
+        """全文搜索消息，优先使用本地消息库的索引，没有消息库时逐条匹配快照"""
+        if self.store is not None:
+            if not self.store.populated:
+                # 首次同步完成后搜索结果才完整
+                self._get_snapshot(False)
+            return self.store.search(query, limit, offset, author)
+        
+        hits = [msg for msg in reversed(self._get_snapshot(False).messages)
+                if msg.get('hash') and (not author or msg.get('author') == author)
+                and matches(msg.get('content', ''), query)]
+        return {
+            'messages': hits[offset:offset + limit],
+            'total': len(hits),
+            'offset': offset,
+            'limit': limit,
+            'has_more': offset + limit < len(hits),
+            'total_estimated': False
+        }
+    
+    def display_search(self, query, limit=20):
+        """在命令行显示搜索结果"""
+        from rich.text import Text
+        result = self.search_messages(query, limit)
+        if not result['messages']:
+            self.console.print(f"\n没有找到包含“{query}”的消息", style="grey50")
+            return
+        
+        about = '约 ' if result.get('total_estimated') else ''
+        self.console.print(f"\n=== 搜索“{query}”：共 {about}{result['total']} 条 ===", style="grey50")
+        for msg in result['messages']:
+            message = Text()
+            timestamp = datetime.fromisoformat(msg['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+            message.append(f"[{timestamp}] ", style="grey50")
+            message.append(f"{msg['author']}: ", style="orange3")
+            message.append(msg['content'])
+            self.console.print(message)
+        self.console.print("================", style="grey50")
+    
+    def display_metrics(self):
+        """在命令行显示耗时指标和计数器的汇总"""
+        if not metrics.is_enabled():
+            self.console.print("\n指标记录未开启，可在配置中设置 metrics 为 true", style="grey50")
+            return
+        timings, counters = metrics.summary()
+        self.console.print("\n=== 耗时统计 ===", style="grey50")
+        self.console.print(f"{'操作':<32}{'次数':>8}{'总计(s)':>10}{'平均(ms)':>10}{'最大(ms)':>10}", style="grey50")
+        for name, count, total, mean_ms, max_ms in timings:
+            self.console.print(f"{name:<32}{count:>8}{total:>10.2f}{mean_ms:>10.2f}{max_ms:>10.2f}")
+        if counters:
+            self.console.print("=== 计数 ===", style="grey50")
+            for name, value in counters:
+                self.console.print(f"{name:<32}{value:>8}")
+        self.console.print("================", style="grey50")
+    
+    def _display_source(self):
+        """获取要显示的最新消息，优先读取本地消息库"""
+        limit = self.config.get('display_limit', DEFAULT_DISPLAY_LIMIT)
+        if self.store is not None and self.store.populated:
+            if self.syncer.snapshot.version:
+                # 增量同步很快，同步结果会写入本地消息库
+                self._get_snapshot(True)
+            else:
+                # 首次同步需要解密全部历史，在后台进行，先显示库中已有的消息
+                self.syncer.request_sync()
+                self.console.print("\n正在后台同步最新消息…", style="grey50")
+            return self.store.latest(limit)
         messages = self.get_messages()
+        return messages[-limit:] if limit else messages
+    
+    def display_messages(self):
+        from rich.text import Text
+        messages = self._display_source()
         if not messages:
             self.console.print("\n暂无消息记录", style="grey50")
             return
@@ -89,6 +301,56 @@ class GitChat:
         
         self.console.print("================", style="grey50")
 
+def message_cursor(message):
+    """获取消息的游标（优先使用消息哈希）"""
+    return message.get('hash') or message.get('timestamp')
+
+def _cursor_index(messages, cursor, inclusive=False, index=None):
+    """定位游标在消息列表中的位置
+    
+    返回游标消息之后第一条消息的下标；inclusive 为 True 时返回游标消息本身的下标。
+    index 为消息哈希到下标的映射；找不到对应哈希时按时间戳比较，
+    游标也不是时间戳时抛出 InvalidCursorError。
+    """
+    if index is not None:
+        position = index.get(cursor)
+    else:
+        position = next((i for i in range(len(messages) - 1, -1, -1)
+                         if messages[i].get('hash') == cursor), None)
+    if position is not None:
+        return position if inclusive else position + 1
+    timestamp_cursor(cursor)
+    # 消息按时间戳排序，可以二分查找
+    if inclusive:
+        return bisect_left(messages, cursor, key=lambda msg: msg['timestamp'])
+    return bisect_right(messages, cursor, key=lambda msg: msg['timestamp'])
+
+def paginate_messages(messages, since=None, before=None, limit=None, index=None):
+    """对按时间排序的消息列表做游标分页，返回带前后游标的结果"""
+    start, end = 0, len(messages)
+    if since is not None:
+        start = _cursor_index(messages, since, index=index)
+    if before is not None:
+        end = max(_cursor_index(messages, before, inclusive=True, index=index), start)
+    
+    if limit:
+        if since is not None and before is None:
+            # 向后翻页：从游标之后开始取
+            end = min(end, start + limit)
+        else:
+            # 最新一页或向前翻页：取最靠近末尾的 limit 条
+            start = max(start, end - limit)
+    
+    page = list(messages[start:end])
+    return {
+        'messages': page,
+        # 下一页（更新的消息）从本页最后一条之后开始，本页为空时沿用原游标
+        'next_cursor': message_cursor(page[-1]) if page else since,
+        'prev_cursor': message_cursor(page[0]) if page else before,
+        'has_more_before': start > 0,
+        'has_more_after': end < len(messages)
+    }
+
 def run_chat():
     # 检查是否需要修改配置
     if os.path.exists(os.path.join(os.path.expanduser('~/.gitchat'), 'config.json')):
@@ -191,6 +453,9 @@ def run_chat():
     # 保存仓库地址到最近使用列表
     save_recent_repo(platform_name, repo_url, chat_mnemonic)
     
+    # 命令行默认不记录耗时指标
+    metrics.enable(config.get('metrics', False))
+    
     # 初始化聊天
     chat = GitChat(
         repo_url,
@@ -200,10 +465,16 @@ def run_chat():
         chat_mnemonic
     )
     
+    # 后台同步新消息，显示时直接读取本地消息库
+    chat.start_sync()
+    
     print("\n🎉 欢迎使用Git聊天工具！")
     print("- 输入消息后按回车发送")
     print("- 输入 'q' 退出")
     print("- 输入 'r' 刷新消息")
+    print("- 输入 '/s 关键词' 搜索消息")
+    if metrics.is_enabled():
+        print("- 输入 '/m' 查看耗时统计")
     
     last_update = time.time()
     
@@ -216,11 +487,16 @@ def run_chat():
         user_input = input("\n请输入消息: ").strip()
         
         if user_input.lower() == 'q':
+            chat.close()
             print("👋 再见！")
             break
         elif user_input.lower() == 'r':
             chat.display_messages()
             last_update = time.time()
+        elif user_input.startswith('/s '):
+            chat.display_search(user_input[3:].strip())
+        elif user_input == '/m':
+            chat.display_metrics()
         elif user_input:
             if chat.send_message(user_input, config['display_name']):
                 chat.display_messages()
@@ -1,29 +1,99 @@
 import os
 import git
 import json
+import shutil
 from datetime import datetime
 import logging
 import time
-import requests
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
-from src.config import load_config
+from src.config import get_config_snapshot
 from src.crypto.crypto_utils import MessageCrypto
+from src.crypto.message_cache import DecryptedMessageCache, DEFAULT_CACHE_MAX_BYTES
+from src.crypto.parallel_decrypt import ParallelDecryptor, DEFAULT_CHUNK_SIZE, DEFAULT_PARALLEL_THRESHOLD
+from src.git import message_log, object_commit
+from src.git.chain_checkpoint import ChainCheckpoints
+from src.git.compaction import pull_compacted, merge_fetched
+from src.git import connectivity, mirrors
+from src import metrics
 import hashlib
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
-# 设置日志
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# 新设备加入聊天的方式：完整克隆、浅克隆、按需下载文件内容的部分克隆、只检出最近分段的稀疏检出
+JOIN_MODES = ('full', 'shallow', 'partial', 'sparse')
+# 浅克隆默认获取的提交数
+DEFAULT_JOIN_DEPTH = 50
+# 稀疏检出且未设置 recent_segments 时默认检出的最近分段数
+DEFAULT_SPARSE_SEGMENTS = 3
+# 提交时 main 分支被其他写入者移动后的最大尝试次数
+COMMIT_RETRIES = 3
+
 class GitMessenger:
-    def __init__(self, repo_path, remote_url=None, username=None, token=None, chat_mnemonic=None):
+    def __init__(self, repo_path, remote_url=None, username=None, token=None, chat_mnemonic=None,
+                 cache_max_bytes=None, recent_segments=None, batch_window=0.5, max_batch_size=100,
+                 remote_probe_ttl=2.0, chat_key=None, decrypt_workers=None,
+                 decrypt_chunk_size=DEFAULT_CHUNK_SIZE, parallel_threshold=DEFAULT_PARALLEL_THRESHOLD,
+                 join_mode='full', join_depth=DEFAULT_JOIN_DEPTH, connection_ttl=connectivity.DEFAULT_CHECK_TTL,
+                 bare=False, mirror_urls=None, push_quorum=mirrors.DEFAULT_PUSH_QUORUM):
         self.repo_path = repo_path
         self.remote_url = remote_url
         self.username = username
         self.token = token
-        # 只使用聊天助记词
-        self.crypto = MessageCrypto(chat_mnemonic) if chat_mnemonic else None
+        # 只使用聊天助记词，chat_key 为已派生好的密钥（可跳过密钥派生）
+        self.crypto = MessageCrypto(chat_mnemonic, chat_key) if chat_mnemonic else None
+        # 已解密消息缓存，只有新的密文才会走解密流程
+        self.message_cache = DecryptedMessageCache(cache_max_bytes or DEFAULT_CACHE_MAX_BYTES)
+        # 大量未缓存的消息（首次打开、加载历史分段）使用多进程解密
+        self.decryptor = ParallelDecryptor(
+            self.crypto, decrypt_workers, decrypt_chunk_size, parallel_threshold
+        ) if self.crypto else None
+        # 增量同步状态：上次处理到的提交、各消息文件的解析进度
+        self._last_commit = None
+        self._file_states = {}
+        self._messages = []
+        # 只加载最新的若干个分段（None 表示全部），更早的分段按需加载
+        self.recent_segments = recent_segments
+        self._loaded_periods = None
+        # 仓库操作锁：发送线程与读取消息的调用方共享同一个工作区
+        self._repo_lock = threading.RLock()
+        # 发送队列：窗口期内的消息合并为一次提交和推送
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._outbox = []
+        self._outbox_cond = threading.Condition()
+        self._flusher = None
+        self._closed = False
+        self.batches_sent = 0
+        self.messages_sent = 0
+        # 远程变更探测：远程 main 与上次合并的提交相同时跳过拉取
+        self.remote_probe_ttl = remote_probe_ttl
+        self._probed_remote_head = None
+        self._probed_at = 0.0
+        self._merged_remote_head = None
+        # 加入方式只在本地还没有仓库时生效
+        if join_mode not in JOIN_MODES:
+            raise ValueError(f"不支持的加入方式: {join_mode}，可选: {', '.join(JOIN_MODES)}")
+        self.join_mode = join_mode
+        self.join_depth = join_depth
+        self.connection_ttl = connection_ttl
+        # 稀疏检出时未检出的更早消息文件
+        self._sparse_excluded = set()
+        # 新建仓库时是否使用没有工作区的裸仓库（已有仓库以磁盘上的为准）
+        self.bare = bare
+        # 镜像远程：并行推送，达到 push_quorum 个确认即成功；拉取使用最先响应的远程
+        self.mirror_urls = list(mirror_urls or [])
+        self.push_quorum = max(1, push_quorum)
+        self.mirrors = []
+        self._mirror_executor = None
+        self._reconcile_executor = None
+        self._reconcile_pending = set()
+        self._reconcile_lock = threading.Lock()
+        # 各远程正在进行的推送数，后台同步不与之并发推送
+        self._pushing = {}
+        self._sync_stats = {'probes': 0, 'pulls': 0, 'pulls_skipped': 0, 'pull_time': 0.0, 'time_saved': 0.0,
+                            'verify_skipped': 0}
         
         # 配置 git 的全局设置
         self._configure_git()
@@ -36,7 +106,20 @@ class GitMessenger:
                 self.remote_url = remote_url.replace('https://', f'https://{username}:{token}@')
                 logger.debug(f"设置认证URL: {self.remote_url.replace(token, '****')}")
         
-        self.repo = self._init_repo()
+        with metrics.span('repo_init'):
+            self.repo = self._init_repo()
+        self.bare = self.repo.bare
+        if self.remote_url:
+            self.mirrors = mirrors.configure_mirrors(self.repo, self.mirror_urls)
+        if self.mirrors:
+            # 每个远程同时可能有一次获取和一次推送；后台合并需要仓库锁，单独使用一个线程
+            self._mirror_executor = ThreadPoolExecutor(max_workers=2 * (len(self.mirrors) + 1),
+                                                       thread_name_prefix="GitMirror")
+            self._reconcile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="GitMirrorSync")
+        self._remember_remote_head()
+        self._load_sparse_state()
+        # 已验证前缀的检查点，重新打开聊天时跳过这部分消息的哈希验证
+        self.checkpoints = ChainCheckpoints(self.repo)
     
     def _configure_git(self):
         """配置git全局设置"""
@@ -56,36 +139,17 @@ class GitMessenger:
             logger.warning(f"配置git设置时出错: {str(e)}")
     
     def _check_git_connection(self):
-        """检查与Git服务器的连接"""
-        try:
-            session = requests.Session()
-            retries = Retry(total=3, backoff_factor=0.5)
-            session.mount('https://', HTTPAdapter(max_retries=retries))
-            
-            # 根据URL判断是GitHub还是Gitee
-            if 'github.com' in self.remote_url:
-                test_url = 'https://api.github.com'
-                response = session.get(test_url, timeout=10)
-            elif 'gitee.com' in self.remote_url:
-                # Gitee API需要带上token才能访问
-                config = load_config()
-                if 'platforms' in config and 'Gitee' in config['platforms']:
-                    token = config['platforms']['Gitee']['token']
-                    test_url = 'https://gitee.com/api/v5/user'
-                    headers = {'Authorization': f'token {token}'}
-                    response = session.get(test_url, headers=headers, timeout=10)
-                else:
-                    # 如果没有配置Gitee，直接检查gitee.com是否可访问
-                    test_url = 'https://gitee.com'
-                    response = session.get(test_url, timeout=10)
-            else:
-                raise ValueError("不支持的Git服务商，目前仅支持GitHub和Gitee")
-            
-            response.raise_for_status()
-            return True
-        except Exception as e:
-            logger.error(f"Git服务器连接测试失败: {str(e)}")
-            return False
+        """检查与Git服务器的连接（共享连接池，成功的结果在一段时间内复用）"""
+        token = self.token
+        if not token and self.remote_url and 'gitee.com' in self.remote_url:
+            # 没有传入令牌时使用配置中的 Gitee 令牌
+            token = get_config_snapshot().get('platforms', {}).get('Gitee', {}).get('token')
+        return connectivity.check_connection(self.remote_url, token, self.connection_ttl)
+    
+    def _wait_for_connection(self, connection):
+        """等待后台的连接检查结果，连接失败时抛出异常"""
+        if not connection.result():
+            raise Exception("无法连接到Git服务器，请检查网络连接")
     
     def _git_operation_with_retry(self, operation, max_retries=3):
         """带重试机制的git操作"""
@@ -98,27 +162,312 @@ class GitMessenger:
                 logger.warning(f"Git操作失败，尝试重试 ({attempt + 1}/{max_retries})")
                 time.sleep(2 ** attempt)  # 指数退避
     
-    def _get_message_file(self, username):
-        """获取用户特定的消息文件路径"""
+    @staticmethod
+    def _safe_username(username):
         # 使用用户名创建文件名，避免特殊字符
-        safe_username = "".join(c for c in username if c.isalnum() or c in '-_')
-        return os.path.join(self.repo_path, f'messages_{safe_username}.json')
+        return "".join(c for c in username if c.isalnum() or c in '-_')
+    
+    def _get_message_file(self, username, suffix=message_log.LOG_SUFFIX, period=None):
+        """获取用户特定的消息文件路径，period 为分段标识（YYYY-MM）"""
+        file_name = message_log.message_file_name(self._safe_username(username), period, suffix)
+        return os.path.join(self.repo_path, file_name)
+    
+    def _get_last_hash(self, username, head, changes):
+        """获取用户在 head（叠加尚未提交的 changes）中最后一条消息的哈希值，用于跨分段延续哈希链
+
+        直接读取提交中的文件内容，而不是工作区：提交冲突重试时哈希链与实际追加到的文件一致，
+        裸仓库和稀疏检出未检出的分段也同样适用。
+        """
+        files = set(object_commit.list_files(self.repo, head)) | set(changes)
+        files = [name for name in files if message_log.is_message_file(name) and changes.get(name, b'') is not None]
+        segments = message_log.group_segments(files).get(self._safe_username(username), [])
+        # 从最新的分段向前查找，跳过只有文件头的空分段
+        for file_name in reversed(segments):
+            data = changes[file_name] if file_name in changes else object_commit.read_blob(self.repo, head, file_name)
+            last = message_log.last_message(data or b'', file_name)
+            if last:
+                try:
+                    return self._decrypt_message(last).get('hash')
+                except Exception as e:
+                    logger.error(f"获取前一条消息哈希失败: {str(e)}")
+                    return None
+        return None
+    
+    def _decrypt_message(self, encrypted_message):
+        """解密并验证消息，优先使用缓存"""
+        message_dict = self.message_cache.get(encrypted_message)
+        if message_dict is None:
+            message_dict = self.crypto.decrypt_message(encrypted_message)
+            self.message_cache.put(encrypted_message, message_dict)
+            metrics.inc('messages_decrypted')
+        else:
+            metrics.inc('decrypt_cache_hits')
+        return message_dict
+    
+    def _decrypt_messages(self, encrypted_messages, verify=True):
+        """按顺序批量解密并验证消息，未命中缓存的部分交给解密器
+
+        返回列表中每项为消息字典或 ValueError；verify 为 False 时跳过哈希验证。
+        """
+        results = [self.message_cache.get(encrypted_msg) for encrypted_msg in encrypted_messages]
+        misses = [i for i, message_dict in enumerate(results) if message_dict is None]
+        metrics.inc('decrypt_cache_hits', len(results) - len(misses))
+        if misses:
+            with metrics.span('decrypt_batch'):
+                decrypted = self.decryptor.decrypt([encrypted_messages[i] for i in misses], verify)
+            metrics.inc('messages_decrypted', len(misses))
+            for i, message_dict in zip(misses, decrypted):
+                if not isinstance(message_dict, ValueError):
+                    self.message_cache.put(encrypted_messages[i], message_dict)
+                results[i] = message_dict
+        return results
+    
+    def cache_stats(self):
+        """获取解密缓存的命中统计"""
+        return self.message_cache.stats()
+    
+    def _probe_remote_head(self):
+        """查询远程 main 分支的最新提交（相当于 ls-remote），结果在短时间内缓存"""
+        now = time.monotonic()
+        if self._probed_remote_head is not None and now - self._probed_at < self.remote_probe_ttl:
+            return self._probed_remote_head
+        self._sync_stats['probes'] += 1
+        self._probed_remote_head = self._probe_remote('origin')
+        self._probed_at = now
+        return self._probed_remote_head
+    
+    def _probe_remote(self, name):
+        """查询一个远程的 main 分支指向的提交，远程仓库为空时返回空字符串"""
+        output = self.repo.git.ls_remote(name, object_commit.MAIN_REF)
+        return output.split()[0] if output.strip() else ''
+    
+    def _skip_pull(self, started):
+        """记录一次跳过的拉取"""
+        stats = self._sync_stats
+        stats['pulls_skipped'] += 1
+        metrics.inc('pull_noop')
+        if stats['pulls']:
+            # 节省的时间按平均拉取耗时减去探测耗时估算
+            saved = stats['pull_time'] / stats['pulls'] - (time.monotonic() - started)
+            stats['time_saved'] += max(saved, 0.0)
+        logger.debug("远程没有新的提交，跳过拉取")
+    
+    def _pull(self, force=False):
+        """拉取远程更改；远程 main 没有变化时跳过 fetch 和合并"""
+        if self.mirrors:
+            return self._pull_mirrors(force)
+        if not force:
+            started = time.monotonic()
+            try:
+                remote_head = self._probe_remote_head()
+            except git.exc.GitCommandError as e:
+                logger.warning(f"探测远程分支失败，直接拉取: {str(e)}")
+                remote_head = None
+            if remote_head is not None and remote_head == self._merged_remote_head:
+                self._skip_pull(started)
+                return False
+        
+        started = time.monotonic()
+        # 远程历史被压缩过时改用新的历史
+        with metrics.span('pull'):
+            pull_compacted(self.repo)
+        self._sync_stats['pulls'] += 1
+        self._sync_stats['pull_time'] += time.monotonic() - started
+        self._remember_remote_head()
+        return True
+    
+    def _push(self):
+        """推送到远程仓库，被拒绝（远程有新提交）时先拉取再重试一次"""
+        with metrics.span('push'):
+            if self.mirrors:
+                return self._push_mirrors()
+            origin = self.repo.remotes.origin
+            # 明确推送 main 分支（裸仓库没有设置上游分支）
+            try:
+                origin.push(object_commit.MAIN_REF).raise_if_error()
+            except git.exc.GitCommandError:
+                logger.debug("推送被拒绝，拉取后重试")
+                metrics.inc('push_rejected')
+                self._pull(force=True)
+                origin.push(object_commit.MAIN_REF).raise_if_error()
+            self._remember_remote_head()
+    
+    def _remotes(self):
+        return ['origin'] + self.mirrors
+    
+    def _tracking_head(self, name):
+        """远程跟踪分支 <远程>/main 指向的提交，尚未获取过时返回 None"""
+        commit = object_commit.resolve(self.repo, f'refs/remotes/{name}/main')
+        return commit.hexsha if commit else None
+    
+    def _fetch_remote(self, name):
+        """获取一个远程的 main 分支（多个远程并行获取，不写入 FETCH_HEAD）"""
+        with metrics.span('fetch_remote', remote=name):
+            self.repo.git.fetch('--no-write-fetch-head', name, f'+{object_commit.MAIN_REF}:refs/remotes/{name}/main')
+    
+    def _merge_remote(self, name):
+        """合并已获取的远程分支，本地已包含时返回 False"""
+        remote_head = self._tracking_head(name)
+        if not remote_head or self.repo.is_ancestor(remote_head, self.repo.head.commit.hexsha):
+            return False
+        merge_fetched(self.repo, name)
+        return True
+    
+    def _push_remote(self, name):
+        with self._reconcile_lock:
+            self._pushing[name] = self._pushing.get(name, 0) + 1
+        try:
+            with metrics.span('push_remote', remote=name):
+                self.repo.git.push(name, object_commit.MAIN_REF)
+        except git.exc.GitCommandError as e:
+            logger.warning(f"推送到远程 {name} 失败: {str(e)}")
+            raise
+        finally:
+            with self._reconcile_lock:
+                self._pushing[name] -= 1
+    
+    def _pull_mirrors(self, force=False):
+        """并行获取所有远程，合并最先响应的远程；各远程获取完成后在后台合并，并补推它们缺少的提交
+
+        获取前先并行探测各远程的 main，全部与已获取并合并的跟踪分支相同时跳过获取。
+        """
+        started = time.monotonic()
+        if not force:
+            if started - self._probed_at < self.remote_probe_ttl:
+                self._skip_pull(started)
+                return False
+            self._sync_stats['probes'] += 1
+            remotes = self._remotes()
+            known = {name: self._tracking_head(name) or '' for name in remotes}
+            probes = {self._mirror_executor.submit(self._probe_remote, name): name for name in remotes}
+            changed = mirrors.first_changed(probes, known)
+            if changed is None:
+                changed = self._reconcile_known(known)
+            if changed is None:
+                self._probed_at = time.monotonic()
+                self._skip_pull(started)
+                return False
+            logger.debug(f"远程 {changed} 有新的提交")
+        with metrics.span('pull'):
+            futures = {self._mirror_executor.submit(self._fetch_remote, name): name for name in self._remotes()}
+            first = mirrors.first_success(futures)
+            logger.debug(f"使用最先响应的远程 {first}")
+            merged = self._merge_remote(first)
+        for future, name in futures.items():
+            future.add_done_callback(lambda future, name=name: self._schedule_reconcile(future, name))
+        self._sync_stats['pulls'] += 1
+        self._sync_stats['pull_time'] += time.monotonic() - started
+        self._probed_at = time.monotonic()
+        return merged
+    
+    def _reconcile_known(self, known):
+        """远程没有新提交时检查已获取的跟踪分支：返回还没有合并的远程名，缺少本地提交的远程在后台补推"""
+        head = self.repo.head.commit.hexsha
+        behind = []
+        for name, commit in known.items():
+            if commit == head:
+                continue
+            if commit and not self.repo.is_ancestor(commit, head):
+                # 已获取但后台合并失败，仍需要拉取
+                return name
+            behind.append(name)
+        for name in behind:
+            self._queue_reconcile(name)
+        return None
+    
+    def _schedule_reconcile(self, future, name):
+        if future.exception() is not None:
+            logger.warning(f"远程 {name} 获取失败: {str(future.exception())}")
+            return
+        self._queue_reconcile(name)
+    
+    def _queue_reconcile(self, name):
+        with self._reconcile_lock:
+            if name in self._reconcile_pending:
+                return
+            self._reconcile_pending.add(name)
+        try:
+            self._reconcile_executor.submit(self._reconcile_remote, name)
+        except RuntimeError:
+            # 已经关闭
+            pass
+    
+    def _reconcile_remote(self, name):
+        """后台合并较慢的远程，并把本地有而它没有的提交推送给它"""
+        with self._reconcile_lock:
+            self._reconcile_pending.discard(name)
+        try:
+            # GitPython 的仓库对象不能被多个线程同时使用，读取引用也需要持有仓库锁
+            with self._repo_lock:
+                self._merge_remote(name)
+                behind = self._tracking_head(name) != self.repo.head.commit.hexsha
+            with self._reconcile_lock:
+                # 正在推送时由那次推送补齐
+                behind = behind and not self._pushing.get(name)
+            if behind:
+                self._push_remote(name)
+        except Exception as e:
+            logger.warning(f"同步远程 {name} 失败: {str(e)}")
+    
+    def _push_mirrors(self):
+        """并行推送到所有远程，达到法定数量的确认即返回；被拒绝的远程合并其新提交后重试一次"""
+        remotes = self._remotes()
+        quorum = min(self.push_quorum, len(remotes))
+        futures = {self._mirror_executor.submit(self._push_remote, name): name for name in remotes}
+        acked, failed = mirrors.wait_quorum(futures, quorum)
+        if len(acked) < quorum:
+            logger.debug("推送未达到法定数量，合并被拒绝的远程后重试")
+            for name in failed:
+                try:
+                    self._fetch_remote(name)
+                    self._merge_remote(name)
+                except git.exc.GitCommandError as e:
+                    logger.warning(f"获取远程 {name} 失败: {str(e)}")
+            futures = {self._mirror_executor.submit(self._push_remote, name): name for name in failed}
+            retried, failed = mirrors.wait_quorum(futures, quorum - len(acked))
+            acked += retried
+            if len(acked) < quorum:
+                raise Exception(f"推送只得到 {len(acked)} 个远程确认，少于要求的 {quorum} 个: "
+                                + '; '.join(f"{name}: {str(e)}" for name, e in failed.items()))
+        logger.debug(f"推送已被 {', '.join(acked)} 确认")
+        self._remember_remote_head()
+    
+    def _remember_remote_head(self):
+        """记录已与本地合并的远程提交"""
+        try:
+            self._merged_remote_head = self.repo.refs['origin/main'].commit.hexsha
+        except (IndexError, ValueError):
+            # 远程仓库为空，与探测结果的空字符串保持一致
+            self._merged_remote_head = ''
+        # 本地刚刚同步过，探测结果可直接沿用
+        self._probed_remote_head = self._merged_remote_head
+        self._probed_at = time.monotonic()
+    
+    def sync_stats(self):
+        """获取拉取次数、跳过次数和节省时间等统计"""
+        return dict(self._sync_stats)
     
     def _init_repo(self):
         try:
-            # 首先检查Git服务器连接
-            if not self._check_git_connection():
-                raise Exception("无法连接到Git服务器，请检查网络连接")
+            # 连接检查在后台进行，与打开本地仓库同时进行，访问远程之前再等待结果
+            connection = connectivity.check_in_background(self._check_git_connection)
+            
+            if self.bare and not os.path.exists(self.repo_path):
+                return self._init_bare_repo(connection)
+            
+            if not os.path.exists(self.repo_path) and self.remote_url and self.join_mode != 'full':
+                self._wait_for_connection(connection)
+                repo = self._clone_repo()
+                if repo:
+                    self._configure_repo(repo)
+                    return repo
             
             if not os.path.exists(self.repo_path):
                 logger.debug(f"创建新仓库: {self.repo_path}")
                 os.makedirs(self.repo_path)
                 repo = git.Repo.init(self.repo_path)
                 
-                # 配置用户信息
-                if self.username:
-                    repo.config_writer().set_value("user", "name", self.username).release()
-                    repo.config_writer().set_value("user", "email", f"{self.username}@users.noreply.github.com").release()
+                self._configure_repo(repo)
                 
                 # 设置默认分支为 main
                 logger.debug("创建并切换到 main 分支")
@@ -128,6 +477,7 @@ class GitMessenger:
                     logger.debug("添加远程仓库")
                     origin = repo.create_remote('origin', self.remote_url)
                     
+                    self._wait_for_connection(connection)
                     try:
                         # 尝试拉取远程仓库
                         logger.debug("尝试拉取远程仓库")
@@ -136,8 +486,8 @@ class GitMessenger:
                     except git.exc.GitCommandError:
                         # 如果拉取失败（可能是新仓库），创建初始提交
                         logger.debug("创建初始提交")
-                        message_file = self._get_message_file(self.username)
-                        open(message_file, 'w', encoding='utf-8').write('[]')
+                        message_file = self._get_message_file(self.username, period=message_log.segment_period())
+                        message_log.create_log(message_file)
                         repo.index.add([os.path.basename(message_file)])
                         repo.index.commit('Initial commit')
                         
@@ -157,10 +507,7 @@ class GitMessenger:
                 logger.debug(f"打开已存在的仓库: {self.repo_path}")
                 repo = git.Repo(self.repo_path)
                 
-                # 配置用户信息
-                if self.username:
-                    repo.config_writer().set_value("user", "name", self.username).release()
-                    repo.config_writer().set_value("user", "email", f"{self.username}@users.noreply.github.com").release()
+                self._configure_repo(repo)
                 
                 # 确保远程仓库配置正确
                 if self.remote_url:
@@ -178,13 +525,17 @@ class GitMessenger:
                     logger.debug("创建 main 分支")
                     repo.create_head('main', origin.refs.main)
                 
-                if repo.active_branch.name != 'main':
+                if repo.bare:
+                    # 裸仓库没有工作区，只需让 HEAD 指向 main
+                    repo.git.symbolic_ref('HEAD', object_commit.MAIN_REF)
+                elif repo.active_branch.name != 'main':
                     logger.debug("切换到 main 分支")
                     repo.heads.main.checkout()
                 
                 # 同步远程更改
+                self._wait_for_connection(connection)
                 logger.debug("同步远程更改")
-                origin.pull('main')
+                pull_compacted(repo)
             
             return repo
             
@@ -192,107 +543,535 @@ class GitMessenger:
             logger.error(f"初始化仓库失败: {str(e)}")
             raise
     
-    def send_message(self, message, author):
+    def _init_bare_repo(self, connection):
+        """新建没有工作区的裸仓库（例如在服务器上运行），消息直接在对象库中读写"""
+        logger.debug(f"创建新的裸仓库: {self.repo_path}")
+        repo = git.Repo.init(self.repo_path, mkdir=True, bare=True)
+        repo.git.symbolic_ref('HEAD', object_commit.MAIN_REF)
+        self._configure_repo(repo)
+        if self.join_mode != 'full':
+            logger.debug(f"裸仓库不支持 {self.join_mode} 加入方式，获取完整历史")
+        
+        if self.remote_url:
+            origin = repo.create_remote('origin', self.remote_url)
+            self._wait_for_connection(connection)
+            try:
+                origin.fetch()
+                object_commit.integrate(repo)
+            except git.exc.GitCommandError:
+                # 远程仓库为空
+                logger.debug("远程仓库没有可获取的分支")
+        
+        if object_commit.resolve(repo) is None:
+            logger.debug("创建初始提交")
+            file_name = os.path.basename(self._get_message_file(self.username, period=message_log.segment_period()))
+            object_commit.commit_files(repo, {file_name: message_log.format_log().encode('utf-8')},
+                                       'Initial commit', None)
+        
+        if self.remote_url:
+            logger.debug("推送到远程仓库")
+            try:
+                repo.git.push('origin', object_commit.MAIN_REF)
+            except git.exc.GitCommandError:
+                # 推送被拒绝时先获取并合并再推送
+                repo.remotes.origin.fetch()
+                object_commit.integrate(repo)
+                repo.git.push('origin', object_commit.MAIN_REF)
+        return repo
+    
+    def _configure_repo(self, repo):
+        """配置用户信息和合并方式"""
+        if self.username:
+            repo.config_writer().set_value("user", "name", self.username).release()
+            repo.config_writer().set_value("user", "email", f"{self.username}@users.noreply.github.com").release()
+        # 各用户只修改自己的消息文件，本地与远程分叉时直接合并即可
+        repo.config_writer().set_value("pull", "rebase", "false").release()
+        # 消息日志按字节偏移增量读取，检出时不能转换换行符（Windows 上 Git 默认开启 autocrlf）
+        repo.config_writer().set_value("core", "autocrlf", "false").release()
+    
+    def _clone_repo(self):
+        """按加入方式克隆远程仓库，远程仓库为空或克隆失败时返回 None（改为新建仓库）"""
+        options = {'branch': 'main', 'config': 'core.autocrlf=false'}
+        if self.join_mode == 'shallow':
+            options['depth'] = self.join_depth
+        else:
+            # 部分克隆只下载检出需要的文件内容，历史版本按需下载
+            options['filter'] = 'blob:none'
+        if self.join_mode == 'sparse':
+            options['no_checkout'] = True
+        
+        logger.debug(f"以 {self.join_mode} 方式克隆远程仓库")
         try:
-            logger.debug("开始发送消息")
-            # 先拉取最新更改
-            origin = self.repo.remotes.origin
-            logger.debug("拉取最新更改")
-            origin.pull()
-            
-            message_file = self._get_message_file(self.username)
-            logger.debug(f"读取消息文件: {message_file}")
+            # --config 使检出就不转换换行符；GitPython 默认拒绝该选项，这里的值是固定的
+            repo = git.Repo.clone_from(self.remote_url, self.repo_path, allow_unsafe_options=True, **options)
+        except git.exc.GitCommandError as e:
+            logger.warning(f"克隆远程仓库失败，改为新建仓库: {str(e)}")
+            shutil.rmtree(self.repo_path, ignore_errors=True)
+            return None
+        
+        if self.join_mode == 'sparse':
+            # 只检出最近的若干个分段，更早的分段在加载历史时再检出
+            files = [name for name in repo.git.ls_tree('--name-only', 'HEAD').splitlines()
+                     if message_log.is_message_file(name)]
+            recent = message_log.recent_periods(files, self.recent_segments or DEFAULT_SPARSE_SEGMENTS)
+            self._sparse_excluded = {name for name in files if message_log.parse_file_name(name)[1] not in recent}
+            self._apply_sparse_checkout(repo)
+            repo.git.checkout('main')
+        return repo
+    
+    def _apply_sparse_checkout(self, repo=None):
+        """检出除未加载分段以外的所有文件"""
+        repo = repo or self.repo
+        patterns = ['/*'] + [f'!/{name}' for name in sorted(self._sparse_excluded)]
+        repo.git.sparse_checkout('set', '--no-cone', *patterns)
+    
+    def _load_sparse_state(self):
+        """从稀疏检出配置中恢复未检出的消息文件"""
+        sparse_file = os.path.join(self.repo.git_dir, 'info', 'sparse-checkout')
+        if not os.path.exists(sparse_file):
+            return
+        with open(sparse_file, 'r', encoding='utf-8') as f:
+            self._sparse_excluded = {line.strip()[2:] for line in f if line.startswith('!/')}
+    
+    def _widen_sparse_checkout(self, count):
+        """检出更早的 count 个分段（部分克隆会按需下载文件内容），返回新检出的文件"""
+        periods = sorted({message_log.parse_file_name(name)[1] for name in self._sparse_excluded})
+        wanted = set(periods[-count:])
+        widened = {name for name in self._sparse_excluded if message_log.parse_file_name(name)[1] in wanted}
+        if not widened:
+            return []
+        self._sparse_excluded -= widened
+        self._apply_sparse_checkout()
+        logger.debug(f"检出更早的分段: {', '.join(sorted(wanted))}")
+        return sorted(widened)
+    
+    def send_message(self, message, author):
+        """发送消息并等待提交和推送完成"""
+        return self.enqueue_message(message, author).result()
+    
+    def enqueue_message(self, message, author):
+        """将消息加入发送队列，返回可查询状态的 Future
+        
+        短时间内连续发送的消息会由后台线程合并为一次提交和一次推送。
+        """
+        future = Future()
+        # 时间戳在入队时确定，保证消息顺序与发送顺序一致
+        message_dict = {
+            'content': message.strip(),
+            'author': author,
+            'timestamp': datetime.now().isoformat()
+        }
+        with self._outbox_cond:
+            if self._closed:
+                raise RuntimeError("消息发送队列已关闭")
+            self._outbox.append((message_dict, future))
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="GitMessengerFlusher", daemon=True)
+                self._flusher.start()
+            self._outbox_cond.notify()
+        return future
+    
+    def outbox_status(self):
+        """获取发送队列状态"""
+        with self._outbox_cond:
+            return {
+                'pending': len(self._outbox),
+                'batches_sent': self.batches_sent,
+                'messages_sent': self.messages_sent
+            }
+    
+    def close(self, timeout=None):
+        """停止后台发送线程，队列中剩余的消息会先发送完"""
+        with self._outbox_cond:
+            self._closed = True
+            self._outbox_cond.notify()
+            flusher = self._flusher
+        if flusher:
+            flusher.join(timeout)
+        if self.decryptor:
+            self.decryptor.close()
+        if self._mirror_executor:
+            # 尚未完成的推送和后台同步继续完成
+            self._mirror_executor.shutdown(wait=False)
+            self._reconcile_executor.shutdown(wait=False)
+    
+    def _flush_loop(self):
+        """后台发送线程：收集窗口期内的消息后批量提交"""
+        while True:
+            with self._outbox_cond:
+                while not self._outbox and not self._closed:
+                    self._outbox_cond.wait()
+                if not self._outbox and self._closed:
+                    return
+                # 等待窗口期结束或批次已满，收集同一批次的消息
+                deadline = time.monotonic() + self.batch_window
+                while len(self._outbox) < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._outbox_cond.wait(remaining)
+                batch = self._outbox[:self.max_batch_size]
+                del self._outbox[:self.max_batch_size]
             
-            # 读取或创建消息文件
-            if os.path.exists(message_file):
-                with open(message_file, 'r', encoding='utf-8') as f:
-                    messages = json.load(f)
+            try:
+                self._commit_batch([message_dict for message_dict, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
             else:
-                messages = []
-            
-            # 获取当前文件中最后一条消息的哈希值
-            prev_hash = None
-            if messages:
-                try:
-                    decrypted_msg = self.crypto.decrypt_message(messages[-1])
-                    prev_hash = decrypted_msg.get('hash')
-                except Exception as e:
-                    logger.error(f"获取前一条消息哈希失败: {str(e)}")
-            
-            # 创建消息字典
-            message_dict = {
-                'content': message.strip(),
-                'author': author,
-                'timestamp': datetime.now().isoformat()
-            }
+                for _, future in batch:
+                    future.set_result(True)
+    
+    def _commit_batch(self, message_dicts):
+        """将一批消息延续哈希链写入分段文件，合并为一次提交并推送
+        
+        新的文件内容直接写入对象库并提交，不经过索引；分支以比较并交换的方式更新，
+        期间被其他写入者移动时重新读取分支后重试。
+        """
+        with self._repo_lock:
+            try:
+                logger.debug(f"开始发送消息（共 {len(message_dicts)} 条）")
+                # 先拉取最新更改
+                logger.debug("拉取最新更改")
+                self._pull()
+                
+                authors = ', '.join(dict.fromkeys(m['author'] for m in message_dicts))
+                if len(message_dicts) == 1:
+                    commit_message = f"Message from {authors}"
+                else:
+                    commit_message = f"{len(message_dicts)} messages from {authors}"
+                
+                for attempt in range(COMMIT_RETRIES):
+                    head = object_commit.resolve(self.repo)
+                    changes, base_sizes = self._build_changes(head, message_dicts)
+                    logger.debug("提交更改")
+                    try:
+                        with metrics.span('commit'):
+                            commit = object_commit.commit_files(self.repo, changes, commit_message, head)
+                        break
+                    except object_commit.RefConflictError:
+                        if attempt == COMMIT_RETRIES - 1:
+                            raise
+                        logger.warning(f"main 分支已被其他写入者更新，重试提交 ({attempt + 1}/{COMMIT_RETRIES})")
+                
+                if not self.repo.bare:
+                    self._sync_working_tree(changes, base_sizes, commit)
+                
+                # 推送到远程仓库
+                logger.debug("推送到远程仓库")
+                self._push()
+                self.batches_sent += 1
+                self.messages_sent += len(message_dicts)
+                
+            except Exception as e:
+                logger.error(f"发送消息失败: {str(e)}")
+                raise
+    
+    def _build_changes(self, head, message_dicts):
+        """基于 head 中的文件内容加密并追加消息，返回 (文件名 -> 新内容或 None, 文件名 -> 原内容长度)"""
+        changes = {}
+        base_sizes = {}
+        
+        # 旧的 JSON 数组文件一次性迁移为（不分段的）追加日志格式
+        legacy_name = os.path.basename(self._get_message_file(self.username, message_log.LEGACY_SUFFIX))
+        legacy_data = object_commit.read_blob(self.repo, head, legacy_name)
+        if legacy_data is not None:
+            logger.debug(f"迁移旧消息文件: {legacy_name}")
+            messages = json.loads(legacy_data) if legacy_data.strip() else []
+            changes[legacy_name] = None
+            changes[os.path.basename(self._get_message_file(self.username))] = \
+                message_log.format_log(messages).encode('utf-8')
+        
+        # 获取该用户最后一条消息的哈希值（可能位于之前的分段），与追加到的文件来自同一个 head
+        prev_hash = self._get_last_hash(self.username, head, changes)
+        
+        logger.debug("保存消息")
+        for message_dict in message_dicts:
+            # 新消息只追加到所属月份的分段，之前的分段保持不变
+            period = message_log.segment_period(datetime.fromisoformat(message_dict['timestamp']))
+            file_name = os.path.basename(self._get_message_file(self.username, period=period))
+            if file_name not in changes:
+                data = object_commit.read_blob(self.repo, head, file_name)
+                base_sizes[file_name] = len(data) if data is not None else None
+                changes[file_name] = bytearray(data if data is not None else message_log.format_log().encode('utf-8'))
             
-            # 加密消息并添加到消息列表
+            # 加密消息并追加到日志末尾，批次内的消息依次延续哈希链
             encrypted_message = self.crypto.encrypt_message(message_dict, prev_hash)
-            messages.append(encrypted_message)
-            
-            # 保存消息
-            logger.debug("保存消息")
-            with open(message_file, 'w', encoding='utf-8') as f:
-                json.dump(messages, f, ensure_ascii=False, indent=2)
-            
-            # 提交更改
-            logger.debug("提交更改")
-            self.repo.index.add([os.path.basename(message_file)])
-            self.repo.index.commit(f"Message from {author}")
-            
-            # 推送到远程仓库
-            logger.debug("推送到远程仓库")
-            origin.push()
-            
-        except Exception as e:
-            logger.error(f"发送消息失败: {str(e)}")
-            raise
+            changes[file_name] += (encrypted_message + '\n').encode('utf-8')
+            prev_hash = message_dict['hash']
+        return changes, base_sizes
     
-    def receive_messages(self):
-        # 拉取最新更改
-        origin = self.repo.remotes.origin
-        origin.pull()
+    def _sync_working_tree(self, changes, base_sizes, commit):
+        """将提交中改动的文件同步到工作区和索引，供读取消息和人工查看"""
+        cacheinfo = []
+        removed = []
+        for file_name, data in changes.items():
+            path = os.path.join(self.repo_path, file_name)
+            if data is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                removed.append(file_name)
+                continue
+            base_size = base_sizes.get(file_name)
+            if base_size is not None and os.path.exists(path) and os.path.getsize(path) == base_size:
+                # 工作区文件与提交前相同，只追加新的部分
+                with open(path, 'ab') as f:
+                    f.write(data[base_size:])
+            else:
+                with open(path, 'wb') as f:
+                    f.write(data)
+            cacheinfo += ['--cacheinfo', f'{object_commit.BLOB_MODE:o},{commit.tree[file_name].hexsha},{file_name}']
+        if removed:
+            cacheinfo += ['--force-remove', '--', *removed]
+        self.repo.git.update_index('--add', *cacheinfo)
+    
+    def _list_message_files(self):
+        """列出工作区（裸仓库为 main 分支）中的所有消息文件"""
+        if self.repo.bare:
+            files = object_commit.list_files(self.repo, object_commit.resolve(self.repo))
+        else:
+            files = os.listdir(self.repo_path)
+        return [f for f in files if message_log.is_message_file(f)]
+    
+    def _changed_message_files(self, head):
+        """获取自上次处理的提交以来发生变化的消息文件，无法比较时返回 None"""
+        if not self._last_commit:
+            return None
+        try:
+            output = self.repo.git.diff(
+                '--name-only', self._last_commit, head, '--',
+                f'{message_log.MESSAGE_PREFIX}*{message_log.LOG_SUFFIX}',
+                f'{message_log.MESSAGE_PREFIX}*{message_log.LEGACY_SUFFIX}'
+            )
+        except git.exc.GitCommandError as e:
+            # 上次的提交可能已不存在（例如历史被改写），退回全量解析
+            logger.warning(f"无法比较提交 {self._last_commit[:8]}..{head[:8]}: {str(e)}")
+            return None
+        return [line.strip() for line in output.splitlines() if line.strip()]
+    
+    def _update_file_state(self, file_name, head):
+        """增量解析单个消息文件，只处理新追加的消息
+
+        已处理的前缀记录 SHA-256 摘要，文件有变化时先确认前缀逐字节未变，否则从头解析并验证。
+        """
+        message_file = os.path.join(self.repo_path, file_name)
+        if self.repo.bare:
+            # 裸仓库没有工作区，读取提交中的文件内容
+            data = object_commit.read_blob(self.repo, self.repo.commit(head), file_name)
+        else:
+            try:
+                with open(message_file, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = None
+        if data is None:
+            self._file_states.pop(file_name, None)
+            return
+        
+        state = self._file_states.get(file_name)
+        if message_log.is_legacy_file(file_name):
+            # 旧格式只能整体读取，但仍然只解密新增的消息
+            raw_messages = json.loads(data) if data.strip() else []
+            if (not state or len(raw_messages) < state['count']
+                    or message_log.legacy_digest(raw_messages[:state['count']]) != state['digest']):
+                state = None
+            new_messages = raw_messages[state['count']:] if state else raw_messages
+            offset = 0
+            digest = message_log.legacy_digest(raw_messages)
+        else:
+            # 日志格式从上次读到的偏移量继续，只解析文件末尾新追加的行
+            if state and message_log.prefix_digest(data, state['offset']) != state['digest']:
+                state = None
+            start = state['offset'] if state else 0
+            new_messages, offset = message_log.parse_log(data, start)
+            digest = message_log.prefix_digest(data, offset)
+            metrics.inc('bytes_read', offset - start)
+        
+        # 已处理的前缀被改动时重新解析整个文件
+        if not state:
+            state = {'count': 0, 'offset': 0, 'digest': None, 'prev_hash': None, 'messages': [],
+                     'intact': True}
+            decrypted_msgs = self._decrypt_with_checkpoint(file_name, head, new_messages)
+        else:
+            decrypted_msgs = self._decrypt_messages(new_messages)
         
-        # 获取所有消息文件
-        message_files = [f for f in os.listdir(self.repo_path) 
-                        if f.startswith('messages_') and f.endswith('.json')]
+        # 每个文件独立维护哈希链
+        # 解密可以并行，哈希链仍按顺序验证
+        prev_hash = state['prev_hash']
+        for decrypted_msg in decrypted_msgs:
+            if not isinstance(decrypted_msg, ValueError):
+                # 只验证同一文件内的哈希链
+                if prev_hash and decrypted_msg.get('prev_hash') != prev_hash:
+                    logger.error(f"文件 {file_name} 的哈希链断裂，消息可能被篡改")
+                    decrypted_msg['content'] = '【警告：消息完整性验证失败】'
+                    state['intact'] = False
+                
+                prev_hash = decrypted_msg.get('hash')
+                state['messages'].append(decrypted_msg)
+            else:
+                logger.error(f"解密消息失败: {str(decrypted_msg)}")
+                state['intact'] = False
+                state['messages'].append({
+                    'content': '【无法解密或验证的消息】',
+                    'author': '未知',
+                    'timestamp': '未知'
+                })
+        
+        state['count'] += len(new_messages)
+        state['offset'] = offset
+        state['digest'] = digest
+        state['prev_hash'] = prev_hash
+        self._file_states[file_name] = state
+        
+        # 完整通过验证的日志文件记录检查点
+        if state['intact'] and state['count'] and not message_log.is_legacy_file(file_name):
+            self.checkpoints.record(file_name, head, state['count'], prev_hash)
+    
+    def _decrypt_with_checkpoint(self, file_name, head, encrypted_messages):
+        """从头解析文件时，检查点之前的已验证前缀只解密、不重新计算哈希"""
+        trusted = None
+        if not message_log.is_legacy_file(file_name):
+            trusted = self.checkpoints.trusted_prefix(file_name, head)
+        if not trusted or trusted[0] > len(encrypted_messages):
+            return self._decrypt_messages(encrypted_messages)
         
+        count, last_hash = trusted
+        prefix = self._decrypt_messages(encrypted_messages[:count], verify=False)
+        last = prefix[-1] if prefix else None
+        if isinstance(last, ValueError) or (last and last.get('hash') != last_hash):
+            # 前缀与检查点不符，完整验证
+            logger.warning(f"文件 {file_name} 与验证检查点不符，重新完整验证")
+            self.checkpoints.discard(file_name)
+            self.message_cache.clear()
+            return self._decrypt_messages(encrypted_messages)
+        self._sync_stats['verify_skipped'] += count
+        return prefix + self._decrypt_messages(encrypted_messages[count:])
+    
+    def _visible_files(self, all_files):
+        """获取当前应加载的消息文件（最新的若干个分段及已按需加载的分段）"""
+        if self.recent_segments is None:
+            return all_files
+        if self._loaded_periods is None:
+            self._loaded_periods = message_log.recent_periods(all_files, self.recent_segments)
+        else:
+            # 新出现的分段（例如跨月后的新文件）总是需要加载
+            known = {message_log.parse_file_name(name)[1] for name in self._file_states}
+            newest = message_log.recent_periods(all_files, 1)
+            self._loaded_periods |= newest - known
+        return [name for name in all_files if message_log.parse_file_name(name)[1] in self._loaded_periods]
+    
+    def _collect_messages(self, all_files):
+        """汇总已加载分段中的消息，并校验同一用户相邻分段之间的哈希链"""
         all_messages = []
+        for user, segments in message_log.group_segments(all_files).items():
+            previous = None
+            for file_name in segments:
+                state = self._file_states.get(file_name)
+                if not state:
+                    previous = None
+                    continue
+                messages = state['messages']
+                if not messages:
+                    # 空分段不影响哈希链的衔接
+                    continue
+                if previous and previous['messages']:
+                    first = messages[0]
+                    last_hash = previous['prev_hash']
+                    if last_hash and first.get('prev_hash') != last_hash:
+                        logger.error(f"文件 {file_name} 与上一分段之间的哈希链断裂，消息可能被篡改")
+                        first = dict(first, content='【警告：消息完整性验证失败】')
+                        messages = [first] + messages[1:]
+                all_messages.extend(messages)
+                previous = state
+        
+        # 按时间戳排序所有消息
+        all_messages.sort(key=lambda x: x['timestamp'])
+        return all_messages
+    
+    def has_older_segments(self):
+        """是否还有未加载的更早分段"""
+        # 同步线程会修改已加载的分段，裸仓库列出文件也要读取对象库，都需要持有仓库锁
+        with self._repo_lock:
+            if self._sparse_excluded:
+                return True
+            if self._loaded_periods is None:
+                return False
+            periods = {message_log.parse_file_name(name)[1] for name in self._list_message_files()}
+            return bool(periods - self._loaded_periods)
+    
+    def load_older_segments(self, count=1):
+        """按需加载更早的 count 个分段，返回加载后的全部消息"""
+        with self._repo_lock:
+            return self._load_older_segments(count)
+    
+    def _load_older_segments(self, count):
+        head = self.repo.head.commit.hexsha
+        all_files = self._list_message_files()
+        local_older = []
+        if self._loaded_periods is not None:
+            local_older = sorted({message_log.parse_file_name(name)[1] for name in all_files} - self._loaded_periods)
+        
+        if self._sparse_excluded and not local_older:
+            # 本地已检出的分段都已加载，检出更早的分段
+            widened = self._widen_sparse_checkout(count)
+            all_files = self._list_message_files()
+            if self._loaded_periods is None:
+                for file_name in widened:
+                    try:
+                        self._update_file_state(file_name, head)
+                    except Exception as e:
+                        logger.error(f"读取消息文件 {file_name} 失败: {str(e)}")
+                self.checkpoints.save()
+                self._messages = self._collect_messages(all_files)
+                return list(self._messages)
+            local_older = sorted({message_log.parse_file_name(name)[1] for name in all_files} - self._loaded_periods)
+        
+        if self._loaded_periods is not None:
+            self._loaded_periods |= set(local_older[-count:])
+            for file_name in self._visible_files(all_files):
+                if file_name not in self._file_states:
+                    try:
+                        self._update_file_state(file_name, head)
+                    except Exception as e:
+                        logger.error(f"读取消息文件 {file_name} 失败: {str(e)}")
+            self.checkpoints.save()
+            self._messages = self._collect_messages(all_files)
+        return list(self._messages)
+    
+    def receive_messages(self):
+        with self._repo_lock:
+            return self._receive_messages()
+    
+    def _receive_messages(self):
+        # 拉取最新更改（远程没有变化时只做一次引用比较）
+        self._pull()
+        
+        # 没有新提交时直接返回上次的结果
+        head = self.repo.head.commit.hexsha
+        if head == self._last_commit:
+            return list(self._messages)
+        
+        all_files = self._list_message_files()
+        changed_files = self._changed_message_files(head)
+        if changed_files is None:
+            self._file_states = {}
+            changed_files = all_files
         
-        for file_name in message_files:
-            message_file = os.path.join(self.repo_path, file_name)
+        visible_files = set(self._visible_files(all_files))
+        for file_name in changed_files:
+            if file_name not in visible_files:
+                # 未加载的分段或已删除的文件
+                self._file_states.pop(file_name, None)
+                continue
             try:
-                with open(message_file, 'r', encoding='utf-8') as f:
-                    raw_messages = json.load(f)
-                    
-                    # 每个文件独立维护哈希链
-                    prev_hash = None
-                    for encrypted_msg in raw_messages:
-                        try:
-                            decrypted_msg = self.crypto.decrypt_message(encrypted_msg)
-                            
-                            # 只验证同一文件内的哈希链
-                            if prev_hash and decrypted_msg.get('prev_hash') != prev_hash:
-                                logger.error(f"文件 {file_name} 的哈希链断裂，消息可能被篡改")
-                                decrypted_msg['content'] = '【警告：消息完整性验证失败】'
-                            
-                            prev_hash = decrypted_msg.get('hash')
-                            all_messages.append(decrypted_msg)
-                            
-                        except ValueError as e:
-                            logger.error(f"解密消息失败: {str(e)}")
-                            all_messages.append({
-                                'content': '【无法解密或验证的消息】',
-                                'author': '未知',
-                                'timestamp': '未知'
-                            })
-                            
+                self._update_file_state(file_name, head)
             except Exception as e:
                 logger.error(f"读取消息文件 {file_name} 失败: {str(e)}")
+        self.checkpoints.save()
         
-        # 按时间戳排序所有消息
-        all_messages.sort(key=lambda x: x['timestamp'])
-        return all_messages
+        self._messages = self._collect_messages(all_files)
+        self._last_commit = head
+        return list(self._messages)
 
 def _setup_repo(self, username, token, chat_mnemonic):
     try:
@@ -0,0 +1,146 @@
+"""消息文件的存储格式
+
+新格式为按行追加的日志文件（messages_<用户>.log）：
+第一行是带版本号的 JSON 头，之后每行一条加密后的消息（Fernet 令牌）。
+发送消息时只需在文件末尾追加一行，不再重写整个文件。
+
+旧格式（messages_<用户>.json）为整个 JSON 数组，仍然可以读取，
+并会在所属用户下次发送消息时一次性迁移为新格式。
+
+消息按作者、按月分段存储（messages_<用户>.<YYYY-MM>.log），
+新消息只追加到当月分段，已结束的分段不会再被改写。
+哈希链在同一作者的各分段之间连续。没有月份的文件视为最早的分段。
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+
+MESSAGE_PREFIX = 'messages_'
+LOG_SUFFIX = '.log'
+LEGACY_SUFFIX = '.json'
+
+LOG_FORMAT = 'sealtext-messages'
+LOG_VERSION = 1
+
+
+def is_message_file(file_name):
+    """判断文件名是否为消息文件（新旧格式均可）"""
+    return file_name.startswith(MESSAGE_PREFIX) and (
+        file_name.endswith(LOG_SUFFIX) or file_name.endswith(LEGACY_SUFFIX)
+    )
+
+
+def segment_period(timestamp=None):
+    """获取时间对应的分段标识（YYYY-MM）"""
+    return (timestamp or datetime.now()).strftime('%Y-%m')
+
+
+def message_file_name(safe_username, period=None, suffix=LOG_SUFFIX):
+    """生成消息文件名，period 为空时为不分段的文件"""
+    if period:
+        return f'{MESSAGE_PREFIX}{safe_username}.{period}{suffix}'
+    return f'{MESSAGE_PREFIX}{safe_username}{suffix}'
+
+
+def parse_file_name(file_name):
+    """解析消息文件名，返回 (用户, 分段标识)，不分段的文件分段标识为空字符串"""
+    stem = os.path.splitext(file_name)[0][len(MESSAGE_PREFIX):]
+    # 用户名只包含字母数字和 -_，因此 . 之后的部分即为分段标识
+    user, _, period = stem.partition('.')
+    return user, period
+
+
+def group_segments(file_names):
+    """按用户分组消息文件，每组按分段从旧到新排序"""
+    groups = {}
+    for file_name in file_names:
+        user, period = parse_file_name(file_name)
+        # 同一分段中旧格式排在前面（迁移过程中两者可能同时存在）
+        groups.setdefault(user, []).append((period, not is_legacy_file(file_name), file_name))
+    return {user: [name for _, _, name in sorted(items)] for user, items in groups.items()}
+
+
+def recent_periods(file_names, count):
+    """获取所有消息文件中最新的 count 个分段标识"""
+    periods = sorted({parse_file_name(name)[1] for name in file_names})
+    return set(periods[-count:]) if count else set()
+
+
+def is_legacy_file(file_name):
+    """判断是否为旧的 JSON 数组格式"""
+    return file_name.endswith(LEGACY_SUFFIX)
+
+
+def format_header():
+    """生成日志文件头"""
+    return json.dumps({'format': LOG_FORMAT, 'version': LOG_VERSION}, sort_keys=True) + '\n'
+
+
+def _check_header(line):
+    """校验日志文件头"""
+    try:
+        header = json.loads(line)
+    except ValueError:
+        raise ValueError("消息日志文件头无效")
+    if not isinstance(header, dict) or header.get('format') != LOG_FORMAT:
+        raise ValueError("未知的消息日志格式")
+    if header.get('version', 0) > LOG_VERSION:
+        raise ValueError(f"不支持的消息日志版本: {header.get('version')}")
+    return header
+
+
+def parse_log(data, offset=0):
+    """从日志内容的 offset 处开始解析
+
+    data: 文件的完整字节内容
+    返回 (密文列表, 新的偏移量)。末尾不完整的行不会被消费。
+    """
+    messages = []
+    if offset == 0:
+        end = data.find(b'\n')
+        if end < 0:
+            return messages, 0
+        _check_header(data[:end].decode('utf-8'))
+        offset = end + 1
+
+    while True:
+        end = data.find(b'\n', offset)
+        if end < 0:
+            break
+        line = data[offset:end].strip()
+        if line:
+            messages.append(line.decode('utf-8'))
+        offset = end + 1
+    return messages, offset
+
+
+def prefix_digest(data, offset):
+    """日志内容前 offset 字节的 SHA-256 摘要，用于确认已处理的前缀没有被改写"""
+    return hashlib.sha256(memoryview(data)[:offset]).hexdigest()
+
+
+def legacy_digest(messages):
+    """旧格式文件中若干条密文的 SHA-256 摘要"""
+    return hashlib.sha256('\n'.join(messages).encode('utf-8')).hexdigest()
+
+
+def last_message(data, file_name):
+    """文件内容（新旧格式均可）中的最后一条密文，没有消息时返回 None"""
+    if is_legacy_file(file_name):
+        messages = json.loads(data) if data.strip() else []
+        return messages[-1] if messages else None
+    # 第一行是文件头，只有一行时没有消息
+    lines = bytes(data).rstrip().rsplit(b'\n', 1)
+    return lines[1].strip().decode('utf-8') if len(lines) == 2 else None
+
+
+def format_log(messages=()):
+    """生成包含文件头和指定消息的日志内容"""
+    return format_header() + ''.join(message + '\n' for message in messages)
+
+
+def create_log(path, messages=()):
+    """创建新的日志文件，可写入已有消息"""
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(format_log(messages))
@@ -0,0 +1,86 @@
+"""聊天仓库的镜像远程
+
+除 origin 外，聊天仓库可以配置多个镜像（例如同时托管在 GitHub 和 Gitee 上），
+依次配置为名为 mirror-1、mirror-2… 的远程。发送时并行推送到所有远程，
+达到法定数量的确认即视为成功；拉取时使用最先响应的远程，其余远程在后台获取、合并并补推。
+"""
+import logging
+from concurrent.futures import FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+MIRROR_PREFIX = 'mirror-'
+# 默认只需一个远程确认推送成功，发送延迟取决于最快的远程
+DEFAULT_PUSH_QUORUM = 1
+
+
+def configure_mirrors(repo, urls):
+    """按顺序将镜像地址配置为远程，删除不再使用的镜像，返回镜像的远程名"""
+    existing = {remote.name: remote for remote in repo.remotes}
+    names = []
+    for index, url in enumerate(urls, 1):
+        name = f'{MIRROR_PREFIX}{index}'
+        remote = existing.get(name)
+        if remote is None:
+            logger.debug(f"添加镜像远程 {name}")
+            repo.create_remote(name, url)
+        elif remote.url != url:
+            remote.set_url(url)
+        names.append(name)
+    for name in existing:
+        if name.startswith(MIRROR_PREFIX) and name not in names:
+            logger.debug(f"删除镜像远程 {name}")
+            repo.delete_remote(name)
+    return names
+
+
+def first_success(futures):
+    """等待最先成功的任务，返回它对应的远程名；全部失败时抛出最后一个异常
+
+    futures: Future -> 远程名
+    """
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return futures[future]
+            error = future.exception()
+    raise error
+
+
+def wait_quorum(futures, quorum):
+    """等待至少 quorum 个任务成功或全部任务结束，返回 (成功的远程名列表, 远程名 -> 异常)
+
+    达到法定数量后立即返回，仍未完成的任务继续在后台运行。
+    """
+    acked, failed = [], {}
+    pending = set(futures)
+    while pending and len(acked) < quorum:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                acked.append(futures[future])
+            else:
+                failed[futures[future]] = future.exception()
+    return acked, failed
+
+
+def first_changed(futures, known):
+    """等待各远程的探测结果，返回第一个与已知提交不同（或探测失败）的远程名；全部相同时返回 None
+
+    futures: Future -> 远程名，结果为远程 main 的提交（空仓库为空字符串）
+    known: 远程名 -> 本地记录的该远程的提交
+    """
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            if future.exception() is not None:
+                logger.warning(f"探测远程 {name} 失败: {str(future.exception())}")
+                return name
+            if future.result() != known.get(name):
+                return name
+    return None
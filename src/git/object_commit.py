@@ -0,0 +1,158 @@
+"""直接在对象库中创建提交
+
+发送消息时不经过工作区和索引：把新的文件内容写成 blob，在父提交的文件树上替换对应条目得到新树，
+创建提交后用 git update-ref 以比较并交换（CAS）的方式更新 refs/heads/main。
+期间分支被其他进程移动时更新失败（RefConflictError），调用方重新读取分支后重试。
+不需要工作区，因此也可以在服务器上的裸仓库中收发消息。
+
+聊天仓库的文件都位于根目录，这里只处理根目录下的文件。
+"""
+import logging
+import os
+from datetime import datetime
+from io import BytesIO
+from stat import S_ISDIR
+
+import git
+from git.objects.fun import tree_entries_from_data, tree_to_stream
+from gitdb import IStream, LooseObjectDB
+
+logger = logging.getLogger(__name__)
+
+MAIN_REF = 'refs/heads/main'
+# update-ref 的旧值为全零时表示分支必须尚不存在
+_NULL_SHA = '0' * 40
+BLOB_MODE = 0o100644
+
+
+class RefConflictError(Exception):
+    """分支在读取之后被其他写入者移动，比较并交换失败"""
+
+
+def resolve(repo, ref=MAIN_REF):
+    """分支当前指向的提交，分支不存在时返回 None"""
+    try:
+        return repo.commit(ref)
+    except (git.exc.BadName, ValueError):
+        return None
+
+
+def read_blob(repo, commit, path):
+    """读取提交中文件的内容，文件不存在时返回 None"""
+    if commit is None:
+        return None
+    try:
+        return commit.tree[path].data_stream.read()
+    except KeyError:
+        return None
+
+
+def list_files(repo, commit):
+    """提交根目录下的文件名"""
+    if commit is None:
+        return []
+    return [blob.name for blob in commit.tree.blobs]
+
+
+def _store(repo, obj_type, data):
+    """在进程内写入松散对象（GitPython 默认的对象库每写一个对象都要启动一次 git hash-object）"""
+    odb = LooseObjectDB(os.path.join(repo.common_dir, 'objects'))
+    return odb.store(IStream(obj_type, len(data), BytesIO(data))).binsha
+
+
+def _write_commit(repo, tree, parents, message):
+    """写入提交对象，作者和提交者取自仓库配置"""
+    reader = repo.config_reader()
+    author, committer = git.Actor.author(reader), git.Actor.committer(reader)
+    now = datetime.now().astimezone()
+    stamp = f"{int(now.timestamp())} {now.strftime('%z')}"
+    lines = [f'tree {tree.hex()}']
+    lines += [f'parent {parent.hexsha}' for parent in parents]
+    lines += [f'author {author.name} <{author.email}> {stamp}',
+              f'committer {committer.name} <{committer.email}> {stamp}',
+              '', message]
+    binsha = _store(repo, b'commit', ('\n'.join(lines) + '\n').encode('utf-8'))
+    return git.Commit(repo, binsha)
+
+
+def _tree_entries(repo, commit):
+    """提交根目录的条目：文件名 -> (binsha, mode)"""
+    if commit is None:
+        return {}
+    data = repo.odb.stream(commit.tree.binsha).read()
+    return {name: (binsha, mode) for binsha, mode, name in tree_entries_from_data(data)}
+
+
+def _write_tree(repo, entries):
+    """按 git 的排序规则（目录名视为带 / 结尾）写入树对象"""
+    def sort_key(name):
+        return name.encode('utf-8') + (b'/' if S_ISDIR(entries[name][1]) else b'')
+
+    stream = BytesIO()
+    tree_to_stream([(entries[name][0], entries[name][1], name) for name in sorted(entries, key=sort_key)],
+                   stream.write)
+    return _store(repo, b'tree', stream.getvalue())
+
+
+def update_ref(repo, new, old, ref=MAIN_REF, message='sealtext'):
+    """以比较并交换的方式更新分支：只有分支仍指向 old（None 表示不存在）时才更新为 new"""
+    try:
+        repo.git.update_ref('-m', message, ref, new, old or _NULL_SHA)
+    except git.exc.GitCommandError as e:
+        raise RefConflictError(f"分支 {ref} 已被其他写入者更新: {str(e)}")
+
+
+def commit_files(repo, changes, message, parent, expected=None, ref=MAIN_REF):
+    """在 parent 的文件树上应用 changes（文件名 -> 新内容，None 表示删除）并提交
+
+    分支必须仍指向 expected（默认为 parent）才会更新，否则抛出 RefConflictError。
+    返回新的提交；不会修改工作区和索引。
+    """
+    entries = _tree_entries(repo, parent)
+    for path, data in changes.items():
+        if data is None:
+            entries.pop(path, None)
+        else:
+            entries[path] = (_store(repo, b'blob', data), BLOB_MODE)
+    tree = _write_tree(repo, entries)
+
+    commit = _write_commit(repo, tree, [parent] if parent is not None else [], message)
+    old = expected if expected is not None else parent
+    update_ref(repo, commit.hexsha, old.hexsha if old is not None else None, ref, message)
+    return commit
+
+
+def integrate(repo, remote_ref='refs/remotes/origin/main', ref=MAIN_REF):
+    """将远程分支并入本地分支（用于没有工作区的裸仓库），返回本地分支是否变化
+
+    能快进时直接快进；双方都有新提交时按文件做三方合并：各用户只修改自己的消息文件，
+    同一个文件两边都改动时视为冲突。
+    """
+    remote = resolve(repo, remote_ref)
+    local = resolve(repo, ref)
+    if remote is None or (local is not None and local == remote):
+        return False
+    if local is None or repo.is_ancestor(local, remote):
+        update_ref(repo, remote.hexsha, local.hexsha if local else None, ref, f'merge {remote_ref}: Fast-forward')
+        return True
+    if repo.is_ancestor(remote, local):
+        return False
+
+    bases = repo.merge_base(local, remote)
+    base_entries = _tree_entries(repo, bases[0] if bases else None)
+    ours, theirs = _tree_entries(repo, local), _tree_entries(repo, remote)
+    merged = {}
+    for name in set(base_entries) | set(ours) | set(theirs):
+        base, mine, other = base_entries.get(name), ours.get(name), theirs.get(name)
+        if mine == other or other == base:
+            entry = mine
+        elif mine == base:
+            entry = other
+        else:
+            raise RuntimeError(f"合并冲突：文件 {name} 在本地和远程都被修改")
+        if entry is not None:
+            merged[name] = entry
+
+    commit = _write_commit(repo, _write_tree(repo, merged), [local, remote], f"Merge remote-tracking branch '{remote_ref}'")
+    update_ref(repo, commit.hexsha, local.hexsha, ref, f'merge {remote_ref}')
+    return True
@@ -0,0 +1,202 @@
+"""运行时指标
+
+记录热点操作（打开仓库、拉取、推送、提交、解密、哈希验证、读取配置）的耗时直方图，
+以及解密消息数、读取字节数、跳过的拉取等计数器。Web 服务端通过 /metrics 以 Prometheus
+文本格式导出，命令行中输入 /m 查看汇总。
+
+默认关闭：关闭时 span() 返回共享的空上下文，inc()/observe() 只检查一次开关即返回，
+对热点路径几乎没有开销。Web 服务端启动时打开；环境变量 SEALTEXT_METRICS=1 或 0 可强制打开或关闭。
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+PREFIX = 'sealtext_'
+# 直方图的桶上限（秒），覆盖从单条消息解密到慢速推送的范围
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_FORCED = os.environ.get('SEALTEXT_METRICS')
+_enabled = _FORCED not in (None, '', '0')
+_lock = threading.Lock()
+# (名称, 标签) -> _Histogram / 计数值
+_histograms = {}
+_counters = {}
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'count', 'sum', 'max')
+
+    def __init__(self):
+        # 每个桶只记录落在该区间内的次数，导出时再累加；最后一个桶为 +Inf
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+
+def enable(on=True):
+    """打开或关闭指标记录；设置了环境变量 SEALTEXT_METRICS 时以环境变量为准"""
+    global _enabled
+    _enabled = _enabled if _FORCED not in (None, '') else bool(on)
+
+
+def is_enabled():
+    return _enabled
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def observe(name, seconds, **labels):
+    """记录一次耗时（秒）"""
+    if _enabled:
+        _observe(_key(name, labels), seconds)
+
+
+def _observe(key, seconds):
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram()
+        histogram.observe(seconds)
+
+
+def inc(name, value=1, **labels):
+    """计数器加 value"""
+    if not _enabled or not value:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+class _Span:
+    __slots__ = ('key', 'name', 'labels', 'started')
+
+    def __init__(self, name, labels):
+        self.key = _key(name, labels)
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _observe(self.key, time.perf_counter() - self.started)
+        if exc_type is not None:
+            inc(f'{self.name}_errors', **self.labels)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **labels):
+    """计时上下文：退出时记录耗时，异常退出时额外累加 <name>_errors 计数"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, labels)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def drain():
+    """取出并清空已记录的指标（用于子进程把指标交回父进程），没有记录时返回 None"""
+    with _lock:
+        if not _histograms and not _counters:
+            return None
+        data = ({key: (h.buckets, h.count, h.sum, h.max) for key, h in _histograms.items()}, dict(_counters))
+        _histograms.clear()
+        _counters.clear()
+    return data
+
+
+def merge(data):
+    """合并 drain() 取出的指标"""
+    if not _enabled or not data:
+        return
+    histograms, counters = data
+    with _lock:
+        for key, (buckets, count, total, maximum) in histograms.items():
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = _Histogram()
+            histogram.buckets = [a + b for a, b in zip(histogram.buckets, buckets)]
+            histogram.count += count
+            histogram.sum += total
+            histogram.max = max(histogram.max, maximum)
+        for key, value in counters.items():
+            _counters[key] = _counters.get(key, 0) + value
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+def render_prometheus():
+    """按 Prometheus 文本格式（0.0.4）导出全部指标"""
+    with _lock:
+        histograms = {key: (list(h.buckets), h.count, h.sum) for key, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        metric = f'{PREFIX}{name}_seconds'
+        lines.append(f'# TYPE {metric} histogram')
+        for (key_name, labels), (buckets, count, total) in sorted(histograms.items()):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for bound, hits in zip(BUCKETS, buckets):
+                cumulative += hits
+                lines.append(f'{metric}_bucket{_format_labels(labels, ("le", repr(bound)))} {cumulative}')
+            lines.append(f'{metric}_bucket{_format_labels(labels, ("le", "+Inf"))} {count}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {total!r}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {count}')
+    for name in sorted({name for name, _ in counters}):
+        metric = f'{PREFIX}{name}_total'
+        lines.append(f'# TYPE {metric} counter')
+        for (key_name, labels), value in sorted(counters.items()):
+            if key_name == name:
+                lines.append(f'{metric}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """汇总：(耗时列表, 计数列表)，耗时为 (名称, 次数, 总计秒, 平均毫秒, 最大毫秒)"""
+    def label(name, labels):
+        return name + _format_labels(labels)
+
+    with _lock:
+        timings = [(label(name, labels), h.count, h.sum, h.sum / h.count * 1000, h.max * 1000)
+                   for (name, labels), h in sorted(_histograms.items())]
+        counters = [(label(name, labels), value) for (name, labels), value in sorted(_counters.items())]
+    return timings, counters
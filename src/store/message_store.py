@@ -0,0 +1,341 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from src.config import local_repo_name
+from src.crypto.crypto_utils import derive_subkey
+from src.store.search_index import tokenize, query_tokens, exact_query, matches
+
+logger = logging.getLogger(__name__)
+
+# 本地消息库的结构版本，结构变化时重建数据库
+STORE_VERSION = 3
+# 默认的本地消息库目录
+DEFAULT_STORE_DIR = os.path.expanduser('~/.gitchat/store')
+# 词项盲索引的内存缓存上限（聊天中的词汇高度重复）
+TOKEN_CACHE_SIZE = 100000
+# 搜索时每次最多读取并解密确认的候选消息数
+SEARCH_BATCH_SIZE = 500
+# 用于确认数据库密钥是否匹配的明文
+_KEY_CHECK = b'sealtext-store'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    hash_index TEXT NOT NULL UNIQUE,
+    author_index TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_messages_author ON messages (author_index, timestamp, id);
+CREATE TABLE IF NOT EXISTS search_tokens (
+    token_index TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (token_index, message_id)
+) WITHOUT ROWID;
+"""
+
+
+class InvalidCursorError(ValueError):
+    """游标既不是已知消息的哈希，也不是 ISO 格式的时间戳"""
+
+
+def timestamp_cursor(cursor):
+    """检查按时间戳比较的游标，不是 ISO 格式的时间戳时抛出 InvalidCursorError"""
+    try:
+        datetime.fromisoformat(cursor)
+    except (TypeError, ValueError):
+        raise InvalidCursorError(f"无效的游标: {cursor}") from None
+    return cursor
+
+
+def store_path(store_dir, platform_name, repo_url):
+    """本地消息库的文件路径，与本地仓库目录同名"""
+    return os.path.join(store_dir, f"{local_repo_name(platform_name, repo_url)}.db")
+
+
+class MessageStore:
+    """每个聊天一个的本地加密消息库（SQLite）
+
+    保存已解密验证过的消息，启动和查询历史时直接读取，不必重新解密整个仓库。
+    消息内容整体用从聊天密钥派生的子密钥加密；作者和消息哈希只保存带密钥的
+    HMAC（盲索引），可以按它们查询但无法从数据库反推；时间戳明文保存，用于排序和范围查询。
+    全文搜索的倒排索引同样只保存词项的盲索引和词频。
+    """
+
+    def __init__(self, path, chat_key):
+        self.path = path
+        self._fernet = Fernet(derive_subkey(chat_key, 'store'))
+        self._index_key = derive_subkey(chat_key, 'store-index')
+        self._search_key = derive_subkey(chat_key, 'search-index')
+        self._token_cache = {}
+        self._lock = threading.Lock()
+        # 上次写入的快照索引（消息哈希 -> 下标），用于增量写入
+        self._applied_index = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = self._open()
+        self._has_data = self.count() > 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _open(self):
+        """打开数据库，密钥或结构版本不匹配时重建"""
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+            meta = dict(conn.execute('SELECT key, value FROM meta'))
+            if not meta:
+                self._init_meta(conn)
+            elif int(meta.get('version', 0)) != STORE_VERSION or not self._check_key(meta.get('key_check')):
+                raise ValueError("消息库版本或密钥不匹配")
+            return conn
+        except (sqlite3.DatabaseError, ValueError) as e:
+            logger.warning(f"本地消息库不可用，重新创建: {str(e)}")
+            conn.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+            conn = self._connect()
+            conn.executescript(_SCHEMA)
+            self._init_meta(conn)
+            return conn
+
+    def _init_meta(self, conn):
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', [
+                ('version', str(STORE_VERSION)),
+                ('key_check', self._fernet.encrypt(_KEY_CHECK).decode('utf-8'))
+            ])
+
+    def _check_key(self, token):
+        try:
+            return token is not None and self._fernet.decrypt(token.encode('utf-8')) == _KEY_CHECK
+        except InvalidToken:
+            return False
+
+    def _blind(self, value):
+        """计算盲索引"""
+        return hmac.new(self._index_key, value.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def _token_index(self, token):
+        """词项的盲索引（截短以减小索引体积，偶尔的碰撞由结果过滤排除）"""
+        token_index = self._token_cache.get(token)
+        if token_index is None:
+            if len(self._token_cache) >= TOKEN_CACHE_SIZE:
+                self._token_cache.clear()
+            token_index = hmac.new(self._search_key, token.encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+            self._token_cache[token] = token_index
+        return token_index
+
+    def _decode(self, payload):
+        return json.loads(self._fernet.decrypt(payload).decode('utf-8'))
+
+    @property
+    def populated(self):
+        """库中是否已有可直接读取的消息（之前保存过，或本次已写入过同步结果）"""
+        return self._has_data or self._applied_index is not None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def add_messages(self, messages):
+        """写入消息，已存在的消息（按哈希）跳过，返回新写入的数量"""
+        with self._lock:
+            rows = []
+            for message in messages:
+                # 解密失败的占位消息没有哈希，不保存
+                if not message.get('hash'):
+                    continue
+                hash_index = self._blind(message['hash'])
+                if self._conn.execute('SELECT 1 FROM messages WHERE hash_index = ?', (hash_index,)).fetchone():
+                    continue
+                payload = self._fernet.encrypt(json.dumps(message, ensure_ascii=False).encode('utf-8'))
+                rows.append(((hash_index, self._blind(message.get('author', '')), message['timestamp'], payload),
+                             message.get('content', '')))
+            if rows:
+                with self._conn:
+                    token_rows = []
+                    for row, content in rows:
+                        cursor = self._conn.execute(
+                            'INSERT OR IGNORE INTO messages (hash_index, author_index, timestamp, payload) '
+                            'VALUES (?, ?, ?, ?)', row
+                        )
+                        if cursor.rowcount:
+                            token_rows.extend((self._token_index(token), cursor.lastrowid, tf)
+                                              for token, tf in tokenize(content).items())
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO search_tokens (token_index, message_id, tf) VALUES (?, ?, ?)',
+                        token_rows
+                    )
+            return len(rows)
+
+    def apply_snapshot(self, snapshot):
+        """将同步快照中新增的消息写入库中（作为同步器的快照回调）"""
+        if self._applied_index is None:
+            added = self.add_messages(snapshot.messages)
+        else:
+            previous = self._applied_index
+            added = self.add_messages(msg for msg in snapshot.messages
+                                      if msg.get('hash') and msg['hash'] not in previous)
+        self._applied_index = snapshot.index
+        if added:
+            logger.debug(f"本地消息库新增 {added} 条消息")
+
+    def _position(self, cursor):
+        """游标对应消息的 (时间戳, id)，找不到时返回 None"""
+        row = self._conn.execute(
+            'SELECT timestamp, id FROM messages WHERE hash_index = ?', (self._blind(cursor),)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def _bound(self, cursor, after):
+        """将游标转换为 SQL 条件；消息哈希按 (时间戳, id) 比较，时间戳按时间戳比较
+
+        游标既不是库中消息的哈希也不是时间戳时抛出 InvalidCursorError。
+        """
+        position = self._position(cursor)
+        if position:
+            return ('(timestamp, id) > (?, ?)' if after else '(timestamp, id) < (?, ?)'), list(position)
+        return ('timestamp > ?' if after else 'timestamp < ?'), [timestamp_cursor(cursor)]
+
+    def _exists(self, conditions, params):
+        where = ' AND '.join(conditions) if conditions else '1'
+        return self._conn.execute(f'SELECT EXISTS (SELECT 1 FROM messages WHERE {where})', params).fetchone()[0] == 1
+
+    def page(self, since=None, before=None, limit=None, author=None):
+        """按游标分页读取消息，返回结构与 paginate_messages 相同"""
+        with self._lock:
+            base, base_params = [], []
+            if author:
+                base.append('author_index = ?')
+                base_params.append(self._blind(author))
+            lower = self._bound(since, True) if since is not None else None
+            upper = self._bound(before, False) if before is not None else None
+
+            conditions, params = list(base), list(base_params)
+            for bound in (lower, upper):
+                if bound:
+                    conditions.append(bound[0])
+                    params.extend(bound[1])
+            where = ' AND '.join(conditions) if conditions else '1'
+
+            # 向后翻页从游标之后取，其余情况取最靠近末尾的 limit 条
+            forward = since is not None and before is None
+            order = 'ASC' if forward or not limit else 'DESC'
+            sql = f'SELECT payload FROM messages WHERE {where} ORDER BY timestamp {order}, id {order}'
+            if limit:
+                sql += f' LIMIT {int(limit) + 1}'
+            rows = [row[0] for row in self._conn.execute(sql, params)]
+
+            truncated = bool(limit) and len(rows) > limit
+            rows = rows[:limit] if limit else rows
+            if order == 'DESC':
+                rows.reverse()
+            messages = [self._decode(payload) for payload in rows]
+
+            # 前后是否还有消息：被 limit 截断的一侧直接可知，另一侧看游标之外是否有消息
+            def outside(bound):
+                if not bound:
+                    return False
+                # 取反游标条件即为游标另一侧（含游标本身）
+                return self._exists(base + [f'NOT ({bound[0]})'], base_params + bound[1])
+
+            has_more_before = (truncated and not forward) or outside(lower)
+            has_more_after = (truncated and forward) or outside(upper)
+
+        return {
+            'messages': messages,
+            'next_cursor': (messages[-1].get('hash') or messages[-1].get('timestamp')) if messages else since,
+            'prev_cursor': (messages[0].get('hash') or messages[0].get('timestamp')) if messages else before,
+            'has_more_before': has_more_before,
+            'has_more_after': has_more_after
+        }
+
+    def search(self, query, limit=20, offset=0, author=None):
+        """全文搜索，按命中词频排序，返回分页结果
+
+        命中全部词项即等于包含搜索词时（中文单字或两字、短词），直接按索引分页，只解密当前页。
+        否则按相关度顺序逐批解密确认，确认到当前页之后的一条即停止；
+        没有确认全部候选时 total 为按已确认比例估算的数量，total_estimated 为 True。
+        """
+        result = {'messages': [], 'total': 0, 'offset': offset, 'limit': limit, 'has_more': False,
+                  'total_estimated': False}
+        tokens = query_tokens(query)
+        if not tokens:
+            return result
+        with self._lock:
+            # 必须命中搜索词的全部词项：以第一个词项的倒排表为主，其余词项按主键逐条查找；
+            # 消息 id 按写入顺序递增，相关度相同时较新的在前
+            indexes = [self._token_index(token) for token in sorted(tokens)]
+            joins = [f'JOIN search_tokens t{i} ON t{i}.token_index = ? AND t{i}.message_id = t0.message_id'
+                     for i in range(1, len(indexes))]
+            params = indexes[1:]
+            if author:
+                joins.append('JOIN messages m ON m.id = t0.message_id AND m.author_index = ?')
+                params.append(self._blind(author))
+            params.append(indexes[0])
+            relevance = ' + '.join(f't{i}.tf' for i in range(len(indexes)))
+            candidates = [row[0] for row in self._conn.execute(f"""
+                SELECT t0.message_id FROM search_tokens t0 {' '.join(joins)}
+                WHERE t0.token_index = ?
+                ORDER BY {relevance} DESC, t0.message_id DESC
+            """, params)]
+
+            if exact_query(query):
+                result['messages'] = self._load(candidates[offset:offset + limit])
+                result['total'] = len(candidates)
+                result['has_more'] = offset + limit < len(candidates)
+                return result
+
+            needed = offset + limit + 1
+            hits, examined, batch_size = [], 0, min(needed, SEARCH_BATCH_SIZE)
+            while len(hits) < needed and examined < len(candidates):
+                batch = candidates[examined:examined + batch_size]
+                examined += len(batch)
+                hits.extend(message for message in self._load(batch) if matches(message.get('content', ''), query))
+                batch_size = min(batch_size * 2, SEARCH_BATCH_SIZE)
+
+        result['messages'] = hits[offset:offset + limit]
+        result['has_more'] = len(hits) > offset + limit
+        if examined < len(candidates):
+            # 其余候选按已确认的比例估算
+            result['total'] = max(round(len(hits) * len(candidates) / examined), len(hits))
+            result['total_estimated'] = True
+        else:
+            result['total'] = len(hits)
+        return result
+
+    def _load(self, ids):
+        """按给定顺序读取并解密消息"""
+        if not ids:
+            return []
+        payloads = dict(self._conn.execute(
+            f"SELECT id, payload FROM messages WHERE id IN ({', '.join('?' * len(ids))})", ids
+        ))
+        return [self._decode(payloads[message_id]) for message_id in ids]
+
+    def latest(self, limit=None):
+        """按时间顺序返回最新的 limit 条消息（不指定时返回全部）"""
+        return self.page(limit=limit)['messages']
@@ -0,0 +1,90 @@
+import re
+from collections import Counter
+
+# 中日韩文字（统一表意文字、扩展 A、兼容表意文字、假名、谚文）
+_CJK = '぀-ヿ㐀-䶿一-鿿豈-﫿가-힯'
+_CJK_RUN = re.compile(f'[{_CJK}]+')
+# 其他语言按字母数字组成的词切分
+_WORD = re.compile(f'[^\\W{_CJK}]+')
+
+# 英文等按三元组索引；短于三个字符的词无法用三元组查找，整词作为一个词项索引（只能按整词搜索）
+TRIGRAM = 3
+
+
+def _cjk_tokens(run):
+    """中日韩文字没有空格分词，索引单字和相邻两字"""
+    tokens = list(run)
+    tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _word_tokens(word):
+    if len(word) < TRIGRAM:
+        return [word]
+    return [word[i:i + TRIGRAM] for i in range(len(word) - TRIGRAM + 1)]
+
+
+def tokenize(text):
+    """将消息内容切分为索引词项，返回 词项 -> 出现次数"""
+    text = text.lower()
+    counts = Counter()
+    for run in _CJK_RUN.findall(text):
+        counts.update(_cjk_tokens(run))
+    for word in _WORD.findall(text):
+        counts.update(_word_tokens(word))
+    return counts
+
+
+def _cover(text, size):
+    """覆盖整段文字的最少的相邻 size 字片段（首尾相接，最后一段与前一段可以重叠）"""
+    starts = list(range(0, len(text) - size + 1, size))
+    if starts[-1] != len(text) - size:
+        starts.append(len(text) - size)
+    return [text[i:i + size] for i in starts]
+
+
+def query_tokens(query):
+    """将搜索词切分为需要同时命中的词项
+
+    中文连续两字以上按相邻两字、英文等词按三元组，取能覆盖整个词的最少片段
+    （搜索结果需要由 matches 确认，词项只用于缩小候选范围），因此搜索词可以是词的一部分；
+    中文单字用单字，短于三个字符的词按整词匹配。
+    """
+    query = query.lower()
+    tokens = set()
+    for run in _CJK_RUN.findall(query):
+        tokens.update(_cover(run, 2) if len(run) > 1 else [run])
+    for word in _WORD.findall(query):
+        tokens.update(_cover(word, TRIGRAM) if len(word) >= TRIGRAM else [word])
+    return tokens
+
+
+def exact_query(query):
+    """命中全部词项是否就等于包含搜索词，不需要逐条确认
+
+    中文单字、相邻两字，英文等不超过三个字符的词各自只对应一个词项，命中即包含。
+    """
+    query = query.lower()
+    return (all(len(run) <= 2 for run in _CJK_RUN.findall(query))
+            and all(len(word) <= TRIGRAM for word in _WORD.findall(query)))
+
+
+def query_parts(query):
+    """搜索词中需要同时出现在消息内容里的各个部分"""
+    query = query.lower()
+    return _CJK_RUN.findall(query) + _WORD.findall(query)
+
+
+def matches(content, query):
+    """消息内容是否包含搜索词的每个部分（用于排除索引的误命中），短于三个字符的词需要整词出现"""
+    content = content.lower()
+    words = None
+    for part in query_parts(query):
+        if len(part) < TRIGRAM and _WORD.fullmatch(part):
+            if words is None:
+                words = set(_WORD.findall(content))
+            if part not in words:
+                return False
+        elif part not in content:
+            return False
+    return True